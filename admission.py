@@ -0,0 +1,138 @@
+from flask import current_app, jsonify, make_response #for rejecting requests inside a view
+from functools import wraps #keeps the view's name so flask routing still works
+from math import ceil #Retry-After is whole seconds
+import threading, time #slots are shared by every request thread
+
+class CostClass: #how many requests of one kind may run and wait at once
+    def __init__(self, limit, queue, wait_ms, priority):
+        self.limit = limit #most requests of this class running at once
+        self.queue = queue #most requests of this class waiting for a slot, more are turned away straight away
+        self.wait = wait_ms / 1000 #longest a request waits for a slot before it is turned away
+        self.priority = priority #higher classes get a free slot first
+
+class HeldBody: #streamed response body that runs done once, when it is used up or the server closes it
+    def __init__(self, body, done):
+        self.body = iter(body)
+        self.done = done
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.body)
+        except BaseException: #the end of the stream or an error while streaming
+            self.close()
+            raise
+
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            if hasattr(self.body, "close"):
+                self.body.close()
+            self.done()
+
+def parse_class(spec, priority): #"limit,queue,wait_ms" from the environment
+    limit, queue, wait_ms = (int(part) for part in spec.split(","))
+    return CostClass(limit, queue, wait_ms, priority)
+
+class AdmissionControl: #per class concurrency limits under one overall budget, with bounded waiting and fast rejections
+    def __init__(self, total, classes):
+        self.total = total #most limited requests running at once, keep it at or below the db pool size
+        self.classes = classes #name -> CostClass
+        self.condition = threading.Condition()
+        self.active = dict.fromkeys(classes, 0)
+        self.waiting = dict.fromkeys(classes, 0)
+        self.admitted = dict.fromkeys(classes, 0)
+        self.rejected = {(name, reason): 0 for name in classes for reason in ("queue_full", "timeout")}
+        self.average = dict.fromkeys(classes, 0.05) #moving average of seconds per request, for Retry-After
+
+    def can_start(self, name): #caller holds the lock
+        return self.active[name] < self.classes[name].limit and sum(self.active.values()) < self.total
+
+    def outranked(self, name): #a waiting request of a higher class could take the slot, caller holds the lock
+        priority = self.classes[name].priority
+        return any(self.waiting[other] and cost.priority > priority and self.can_start(other) for other, cost in self.classes.items())
+
+    def acquire(self, name): #takes a slot, returns None when admitted or the reason it was turned away
+        cost = self.classes[name]
+        with self.condition:
+            if not self.waiting[name] and self.can_start(name) and not self.outranked(name):
+                self.active[name] += 1
+                self.admitted[name] += 1
+                return None
+            if self.waiting[name] >= cost.queue:
+                self.rejected[(name, "queue_full")] += 1
+                return "queue_full"
+            deadline = time.monotonic() + cost.wait
+            self.waiting[name] += 1
+            try:
+                while not (self.can_start(name) and not self.outranked(name)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected[(name, "timeout")] += 1
+                        return "timeout"
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting[name] -= 1
+            self.active[name] += 1
+            self.admitted[name] += 1
+            return None
+
+    def release(self, name, seconds): #gives the slot back, seconds is how long the request held it
+        with self.condition:
+            self.active[name] -= 1
+            self.average[name] = self.average[name] * 0.9 + seconds * 0.1
+            self.condition.notify_all() #every waiter re-checks, the highest class that fits goes first
+
+    def retry_after(self, name): #seconds until the queue ahead has probably drained
+        with self.condition:
+            return max(1, ceil(self.average[name] * (self.waiting[name] + 1) / self.classes[name].limit))
+
+    def stats(self): #counters for the admission stats endpoint
+        with self.condition:
+            return {name: {
+                "active": self.active[name], "waiting": self.waiting[name], "admitted": self.admitted[name],
+                "rejected": {reason: self.rejected[(name, reason)] for reason in ("queue_full", "timeout")},
+            } for name in self.classes}
+
+    def metric_lines(self): #the same counters in Prometheus text format
+        stats = self.stats()
+        lines = ["# TYPE app_admission_active gauge"]
+        lines += [f'app_admission_active{{class="{name}"}} {s["active"]}' for name, s in stats.items()]
+        lines += ["# TYPE app_admission_queue_depth gauge"]
+        lines += [f'app_admission_queue_depth{{class="{name}"}} {s["waiting"]}' for name, s in stats.items()]
+        lines += ["# TYPE app_admission_admitted_total counter"]
+        lines += [f'app_admission_admitted_total{{class="{name}"}} {s["admitted"]}' for name, s in stats.items()]
+        lines += ["# TYPE app_admission_rejected_total counter"]
+        lines += [f'app_admission_rejected_total{{class="{name}",reason="{reason}"}} {count}' for name, s in stats.items() for reason, count in s["rejected"].items()]
+        return lines
+
+    def limit(self, cost): #decorator for views, cost is a class name or a function returning one for the current request
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                if not current_app.config.get("ADMISSION_CONTROL"):
+                    return view(**kwargs)
+                name = cost() if callable(cost) else cost
+                reason = self.acquire(name)
+                if reason is not None:
+                    #a full queue means too many of this kind of request, a timeout means the whole budget is busy
+                    status, error = (429, "Too many requests of this kind right now.") if reason == "queue_full" else (503, "The server is busy, try again shortly.")
+                    response = make_response(jsonify({"ok": False, "error": error}), status)
+                    response.headers["Retry-After"] = str(self.retry_after(name))
+                    return response
+                started = time.monotonic()
+                try:
+                    response = make_response(view(**kwargs))
+                except BaseException:
+                    self.release(name, time.monotonic() - started)
+                    raise
+                if not response.is_streamed:
+                    self.release(name, time.monotonic() - started)
+                    return response
+                response.response = HeldBody(response.response, lambda: self.release(name, time.monotonic() - started)) #exports keep their slot until the last chunk is sent
+                return response
+            return wrapper
+        return decorator
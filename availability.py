@@ -0,0 +1,69 @@
+import threading, time #the allocator is shared by every request thread
+
+class InventoryAllocator: #keeps the free inventory ids of every (film_id, store_id) in memory and hands each one out once
+    def __init__(self, queries, refresh_interval = 30):
+        self.queries = queries #free_copies and lock_copy statements
+        self.refresh_interval = refresh_interval #seconds before a pool is reloaded to pick up returns made outside this app
+        self.lock = threading.Lock()
+        self.pools = {} #(film_id, store_id) -> set of free inventory_ids
+        self.loaded_at = {} #(film_id, store_id) -> monotonic time the pool was loaded
+        self.claimed = set() #inventory_ids handed out whose rental has not committed yet
+
+    def load(self, conn, film_ids, store_id): #reads the free copies of every film in one query, leaving out copies in the middle of being rented
+        free = {film_id: set() for film_id in film_ids} #films with no free copies still get an empty pool
+        for film_id, inventory_id in conn.execute(self.queries.get("free_copies"), {"film_ids": list(film_ids), "store_id": store_id}):
+            free[film_id].add(inventory_id)
+        now = time.monotonic()
+        with self.lock:
+            for film_id, copies in free.items():
+                self.pools[(film_id, store_id)] = copies - self.claimed
+                self.loaded_at[(film_id, store_id)] = now
+
+    def ensure(self, conn, film_ids, store_id): #loads the pools used for the first time or older than the refresh interval, all in one query
+        now = time.monotonic()
+        stale = [film_id for film_id in film_ids if now - self.loaded_at.get((film_id, store_id), float("-inf")) >= self.refresh_interval]
+        if stale:
+            self.load(conn, stale, store_id)
+
+    def available(self, conn, film_id, store_id): #number of copies that can be rented right now
+        return self.available_many(conn, [film_id], store_id)[film_id]
+
+    def available_many(self, conn, film_ids, store_id): #film_id -> number of copies that can be rented right now
+        self.ensure(conn, film_ids, store_id)
+        with self.lock:
+            return {film_id: len(self.pools[(film_id, store_id)]) for film_id in film_ids}
+
+    def acquire(self, conn, film_id, store_id): #takes a free copy and locks it inside conn's transaction, run at READ COMMITTED on MySQL, None if there are no copies left
+        self.ensure(conn, [film_id], store_id)
+        reloaded = False #an empty pool is reloaded once in case copies came back since the last load
+        while True:
+            with self.lock:
+                pool = self.pools[(film_id, store_id)]
+                inventory_id = pool.pop() if pool else None
+                if inventory_id is not None:
+                    self.claimed.add(inventory_id)
+            if inventory_id is None:
+                if reloaded:
+                    return None
+                self.load(conn, [film_id], store_id)
+                reloaded = True
+                continue
+            params = {"inventory_id": inventory_id, "film_id": film_id, "store_id": store_id}
+            try:
+                locked = conn.execute(self.queries.get("lock_copy"), params).scalar()
+            except Exception: #lock wait timeout, deadlock or a lost connection, the copy was never rented
+                self.release(film_id, store_id, inventory_id)
+                raise
+            if locked is not None:
+                return inventory_id #locked and free, the caller inserts the rental and then calls confirm or release
+            with self.lock:
+                self.claimed.discard(inventory_id) #rented or moved by someone else, leave it out of the pool until the next load
+
+    def confirm(self, inventory_id): #the rental committed, the copy stays out of the pool
+        with self.lock:
+            self.claimed.discard(inventory_id)
+
+    def release(self, film_id, store_id, inventory_id): #the rental rolled back, the copy is free again
+        with self.lock:
+            self.claimed.discard(inventory_id)
+            self.pools.setdefault((film_id, store_id), set()).add(inventory_id)
@@ -0,0 +1,100 @@
+#floods /api/films/search with actor and genre filters while timing the cheap routes, once with ADMISSION_CONTROL off and once on
+#with admission control on the heavy searches are capped and the overflow is turned away with 429/503, so the cheap routes keep a flat p99
+#uses the generated SQLite data from endpoints.py, or the database in --url, the probe rents films unless --read-only is given
+#usage: python benchmarks/admission_load.py --scale 10 --flood 32 --seconds 10
+import argparse, os, random, sys, threading, time #command line options, request picks, flood threads and timing
+from statistics import quantiles #for latency percentiles
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def percentiles(timings): #(p50, p99) in milliseconds
+    if len(timings) < 2:
+        return (timings[0], timings[0]) if timings else (0.0, 0.0)
+    cuts = quantiles(timings, n = 100)
+    return cuts[49], cuts[98]
+
+def run(app, pick, args, admission_on): #one flood, returns probe timings per route and flood status counts
+    app.config["ADMISSION_CONTROL"] = admission_on
+    stop = threading.Event()
+    flood_status = {}
+    lock = threading.Lock()
+
+    def flood(seed): #heavy searches back to back
+        rnd = random.Random(seed)
+        client = app.test_client()
+        while not stop.is_set():
+            status = client.get(f"/api/films/search?actor={rnd.choice(pick['actors'])}&genre={rnd.choice(pick['genres'])}&page={rnd.randint(1, 5)}").status_code
+            with lock:
+                flood_status[status] = flood_status.get(status, 0) + 1
+            if status in (429, 503):
+                time.sleep(args.backoff / 1000) #an impatient client, sooner than Retry-After asks
+
+    probes = { #cheap routes a customer at the counter is waiting on
+        "films/<id>": lambda rnd: ("GET", f"/api/films/{rnd.randint(1, pick['films'])}", None),
+        "customers/<id>": lambda rnd: ("GET", f"/api/customers/{rnd.randint(1, pick['customers'])}", None),
+    }
+    if not args.read_only:
+        probes["POST rentals"] = lambda rnd: ("POST", "/api/rentals", {"customer_id": rnd.randint(1, pick["customers"]), "film_id": rnd.randint(1, pick["films"])})
+    timings = {name: [] for name in probes}
+    probe_status = {}
+
+    def probe(): #one cheap request at a time, like a single till
+        rnd = random.Random(args.seed)
+        client = app.test_client()
+        while not stop.is_set():
+            for name, request in probes.items():
+                method, path, body = request(rnd)
+                started = time.perf_counter()
+                status = client.open(path, method = method, json = body).status_code
+                timings[name].append((time.perf_counter() - started) * 1000)
+                probe_status[status] = probe_status.get(status, 0) + 1
+            time.sleep(args.probe_interval / 1000)
+
+    threads = [threading.Thread(target = flood, args = (args.seed + i,)) for i in range(args.flood)] + [threading.Thread(target = probe)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return timings, flood_status, probe_status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Cheap route latency under a flood of heavy searches, with and without admission control")
+    parser.add_argument("--scale", type = float, default = 10, help = "generated data to use, see endpoints.py")
+    parser.add_argument("--url", help = "use this database instead of generated data")
+    parser.add_argument("--data-dir", default = os.path.join(HERE, "data"), help = "where generated SQLite files are kept")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--flood", type = int, default = 32, help = "threads sending heavy searches")
+    parser.add_argument("--seconds", type = float, default = 10, help = "length of each flood")
+    parser.add_argument("--probe-interval", type = float, default = 20, help = "milliseconds between rounds of cheap requests")
+    parser.add_argument("--backoff", type = float, default = 50, help = "milliseconds a flood thread waits after a 429 or 503")
+    parser.add_argument("--read-only", action = "store_true", help = "leave rentals out of the probe")
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    from endpoints import database #generated SQLite data per scale
+    os.environ["DATABASE_URL"] = args.url or database(args, args.scale)
+    os.environ["RESPONSE_CACHE"] = "0" #every request has to reach the db
+    os.environ.setdefault("SLOW_QUERY_MS", "60000") #every flood search is slow, the log would drown the report
+    sys.path.insert(0, os.path.dirname(HERE)) #so main.py can be imported from the benchmarks folder
+    from main import app, db #the flask app and db object
+    from sqlalchemy import text #allows for SQL queries
+
+    with app.app_context(), db.engine.connect() as conn:
+        pick = {
+            "films": conn.execute(text("SELECT MAX(film_id) FROM film")).scalar(),
+            "customers": conn.execute(text("SELECT MAX(customer_id) FROM customer")).scalar(),
+            "actors": [name[:4].lower() for name in conn.execute(text("SELECT DISTINCT last_name FROM actor")).scalars()],
+            "genres": [name[:3].lower() for name in conn.execute(text("SELECT name FROM category")).scalars()],
+        }
+
+    for admission_on in (False, True):
+        timings, flood_status, probe_status = run(app, pick, args, admission_on)
+        served = flood_status.get(200, 0)
+        print(f"\nadmission control {'on' if admission_on else 'off'}: {args.flood} flood threads for {args.seconds:g}s")
+        print(f"  heavy searches: {served / args.seconds:.1f}/s served, statuses {dict(sorted(flood_status.items()))}")
+        print(f"  cheap route statuses {dict(sorted(probe_status.items()))}")
+        for name, values in timings.items():
+            p50, p99 = percentiles(values)
+            print(f"  {name:16} {len(values):5} requests  p50 {p50:8.1f} ms  p99 {p99:8.1f} ms")
@@ -0,0 +1,56 @@
+#compares renting N films with N sequential POST /api/rentals calls against one POST /api/rentals/batch call
+#this writes to the database in DATABASE_URL, run it against a local copy of sakila, it removes the rentals it adds when it is done
+#usage: python benchmarks/batch_checkout.py --items 20 --rounds 5
+import argparse, os, sys, time #command line options and timing
+from sqlalchemy import text #allows for SQL queries
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) #so main.py can be imported from the benchmarks folder
+from main import app, db #the flask app and db object
+
+def checkout_items(size): #one active customer renting `size` different films that still have a free copy in store 1
+    with app.app_context(), db.engine.connect() as conn:
+        customer_id = conn.execute(text("SELECT customer_id FROM customer WHERE active = 1 ORDER BY customer_id LIMIT 1")).scalar()
+        film_ids = conn.execute(text("""
+            SELECT DISTINCT i.film_id
+            FROM inventory AS i
+            LEFT JOIN rental AS r ON r.inventory_id = i.inventory_id AND r.return_date IS NULL
+            WHERE i.store_id = 1 AND r.rental_id IS NULL
+            ORDER BY i.film_id
+            LIMIT :size
+        """), {"size": size}).scalars().all()
+    return [{"customer_id": customer_id, "film_id": film_id} for film_id in film_ids]
+
+def clean_up(max_rental): #removes every rental added after max_rental
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM rental WHERE rental_id > :max_rental"), {"max_rental": max_rental})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Sequential rentals vs batch checkout")
+    parser.add_argument("--items", type = int, default = 20, help = "films per checkout")
+    parser.add_argument("--rounds", type = int, default = 5, help = "checkouts timed per mode")
+    args = parser.parse_args()
+
+    items = checkout_items(args.items)
+    with app.app_context(), db.engine.connect() as conn:
+        max_rental = conn.execute(text("SELECT COALESCE(MAX(rental_id), 0) FROM rental")).scalar()
+    client = app.test_client()
+
+    timings = {"sequential": [], "batch": []}
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        sequential_ok = sum(client.post("/api/rentals", json = item).get_json()["ok"] for item in items)
+        timings["sequential"].append(time.perf_counter() - started)
+        clean_up(max_rental)
+
+        started = time.perf_counter()
+        batch_ok = sum(r["ok"] for r in client.post("/api/rentals/batch", json = {"items": items}).get_json()["results"])
+        timings["batch"].append(time.perf_counter() - started)
+        clean_up(max_rental)
+
+        if sequential_ok != batch_ok:
+            print(f"warning: sequential rented {sequential_ok} films but batch rented {batch_ok}")
+
+    for name, seconds in timings.items():
+        best = min(seconds)
+        print(f"{name:10} {len(items)} items  best {best * 1000:8.1f} ms  {len(items) / best:8.1f} rentals/s")
+    print(f"batch speedup {min(timings['sequential']) / min(timings['batch']):.1f}x")
@@ -0,0 +1,53 @@
+#measures the latency of every multi-query route with QUERY_FANOUT off and on
+#a fixed sleep is added before every statement to stand in for the network round trip to a remote db,
+#so a local database shows the same critical path as production: the sum of the round trips without fan-out, the longest one with it
+#usage: python benchmarks/fanout_latency.py --rtt-ms 5 --repeat 50
+import argparse, os, sys, time #command line options and timing
+from statistics import median, quantiles #for latency percentiles
+from sqlalchemy import event #for adding the fake round trip
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) #so main.py can be imported from the benchmarks folder
+from main import app, db #the flask app and db object
+
+ROUTES = [ #every route that runs more than one independent query
+    "/api/films/1",
+    "/api/actors/1",
+    "/api/customers/1",
+    "/api/films?ids=1,2,3,4,5,6,7,8,9,10",
+    "/api/actors?ids=1,2,3,4,5",
+    "/api/films/search?title=a&page=2",
+    "/api/customers?page=2",
+    "/api/customers/search?last_name=a&page=2",
+]
+
+def measure(client, path, repeat): #returns (p50, p95) in milliseconds
+    client.get(path) #warm up the pool and any caches
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        status = client.get(path).status_code
+        timings.append((time.perf_counter() - started) * 1000)
+        if status != 200:
+            raise SystemExit(f"{path} returned {status}")
+    return median(timings), quantiles(timings, n = 20)[18]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Query fan-out latency benchmark")
+    parser.add_argument("--rtt-ms", type = float, default = 5.0, help = "simulated round trip added before every statement")
+    parser.add_argument("--repeat", type = int, default = 50, help = "requests per route and mode")
+    args = parser.parse_args()
+
+    with app.app_context():
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def round_trip(*_): #stand-in for the network between app and db
+            time.sleep(args.rtt_ms / 1000)
+
+    app.config["RESPONSE_CACHE"] = False #every request has to reach the db
+    client = app.test_client()
+    print(f"{'route':45} {'serial p50':>11} {'fan-out p50':>12} {'serial p95':>11} {'fan-out p95':>12}")
+    for path in ROUTES:
+        app.config["QUERY_FANOUT"] = False
+        serial = measure(client, path, args.repeat)
+        app.config["QUERY_FANOUT"] = True
+        fanned = measure(client, path, args.repeat)
+        print(f"{path:45} {serial[0]:10.1f}ms {fanned[0]:11.1f}ms {serial[1]:10.1f}ms {fanned[1]:11.1f}ms")
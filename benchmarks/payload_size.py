@@ -0,0 +1,63 @@
+#compares the current list payloads (a dict per row through jsonify) with ?format=columnar, by size before and after compression and by encode time
+#rows are fetched once with the same statements the routes use, only the encoding and compression are timed
+#uses the generated SQLite data from endpoints.py, or the database in --url
+#usage: python benchmarks/payload_size.py --scale 10 --repeat 200
+import argparse, gzip, os, sys, time #command line options, compression and timing
+from statistics import median #for encode times
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def timed(function, repeat): #median milliseconds of one call, and its result
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return median(timings), result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "List payload size and encode time, row objects against columnar")
+    parser.add_argument("--scale", type = float, default = 10, help = "generated data to use, see endpoints.py")
+    parser.add_argument("--url", help = "use this database instead of generated data")
+    parser.add_argument("--data-dir", default = os.path.join(HERE, "data"), help = "where generated SQLite files are kept")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--repeat", type = int, default = 200, help = "encodes timed per payload")
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    from endpoints import database #generated SQLite data per scale
+    os.environ["DATABASE_URL"] = args.url or database(args, args.scale)
+    sys.path.insert(0, os.path.dirname(HERE)) #so main.py can be imported from the benchmarks folder
+    from main import app, db, queries, compression #the flask app, db object, prebuilt statements and compression settings
+    import payload #the columnar encoder
+    from sqlalchemy import text #allows for SQL queries
+
+    with app.app_context(), db.engine.connect() as conn:
+        busiest = conn.execute(text("SELECT customer_id FROM rental GROUP BY customer_id ORDER BY COUNT(*) DESC LIMIT 1")).scalar()
+        cases = { #name -> (statement, parameters), the largest page each route serves
+            "customers pageSize=50": (queries.get("customers_page", False), {"limit": 50, "offset": 0}),
+            "customers/search pageSize=50": (queries.get("customers_search", False, True, False, False, False), {"last": "%a%", "limit": 50, "offset": 0}),
+            "films/search pageSize=50": (queries.get("films_search", False, True, False, False), {"actor": "%a%", "limit": 50, "offset": 0}),
+            "history, busiest customer": (queries.get("customer_history", False), {"customer_id": busiest, "limit": 1000}),
+        }
+        rows = {name: conn.execute(sql, params).mappings().all() for name, (sql, params) in cases.items()}
+
+    encoders = { #how each format turns rows into bytes
+        "rows+jsonify": lambda sql, found: app.json.dumps([dict(r) for r in found]).encode(), #what the routes send today
+        "columnar": lambda sql, found: payload.dumps(payload.columnar(found, sql.selected_columns.keys())),
+    }
+    codings = {"gzip": lambda body: gzip.compress(body, compresslevel = compression.gzip_level, mtime = 0)}
+    if payload.brotli is not None:
+        codings["br"] = lambda body: payload.brotli.compress(body, quality = compression.brotli_quality)
+
+    print(f"encoder: {'orjson' if payload.orjson is not None else 'json'}, gzip level {compression.gzip_level}" + (f", brotli quality {compression.brotli_quality}" if payload.brotli is not None else ", brotli not installed"))
+    print(f"{'payload':30} {'format':13} {'rows':>5} {'bytes':>8} {'encode ms':>10}" + "".join(f" {coding + ' bytes':>11} {coding + ' ms':>8}" for coding in codings))
+    with app.app_context(): #app.json needs the app
+        for name, (sql, _) in cases.items():
+            for label, encode in encoders.items():
+                encode_ms, body = timed(lambda: encode(sql, rows[name]), args.repeat)
+                line = f"{name:30} {label:13} {len(rows[name]):5} {len(body):8} {encode_ms:10.3f}"
+                for compress in codings.values():
+                    compress_ms, packed = timed(lambda: compress(body), args.repeat)
+                    line += f" {len(packed):11} {compress_ms:8.3f}"
+                print(line)
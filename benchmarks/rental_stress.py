@@ -0,0 +1,65 @@
+#fires many concurrent POST /api/rentals at one film, once with the rental-scan lookup and once with the inventory allocator,
+#then checks that no copy ended up with two open rentals and prints the throughput of each mode
+#req/s counts every answer, rentals/s only the rentals that committed, keep --requests at or below --copies to compare the modes like for like
+#this writes to the database in DATABASE_URL, run it against a local copy of sakila, it removes the rows it adds when it is done
+#usage: python benchmarks/rental_stress.py --film 1 --copies 300 --requests 400 --workers 16
+import argparse, os, sys, time #command line options and timing
+from concurrent.futures import ThreadPoolExecutor #for sending requests at the same time
+from sqlalchemy import text, bindparam #allows for SQL queries
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) #so main.py can be imported from the benchmarks folder
+from main import app, db, allocator #the flask app, db object and shared allocator
+
+def run(film_id, copies, requests, workers, use_allocator): #one round of concurrent rentals, returns (seconds, status counts, double rented copies)
+    store_id = 1 #rent_film only rents from store 1
+    with app.app_context(), db.engine.begin() as conn:
+        #adding fresh copies so most of the requests can succeed
+        conn.execute(text("INSERT INTO inventory (film_id, store_id) VALUES (:film_id, :store_id)"), [{"film_id": film_id, "store_id": store_id}] * copies)
+        inventory_ids = conn.execute(text("SELECT inventory_id FROM inventory WHERE film_id = :film_id ORDER BY inventory_id DESC LIMIT :copies"), {"film_id": film_id, "copies": copies}).scalars().all()
+        customers = conn.execute(text("SELECT customer_id FROM customer WHERE active = 1 ORDER BY customer_id LIMIT :n"), {"n": requests}).scalars().all()
+        max_rental = conn.execute(text("SELECT COALESCE(MAX(rental_id), 0) FROM rental")).scalar()
+
+    app.config["INVENTORY_ALLOCATOR"] = use_allocator
+    allocator.pools.clear() #start every round with pools loaded from the db
+    allocator.loaded_at.clear()
+
+    def rent(i): #one request from its own test client, like one counter terminal
+        with app.test_client() as client:
+            return client.post("/api/rentals", json = {"customer_id": customers[i % len(customers)], "film_id": film_id}).status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        statuses = list(pool.map(rent, range(requests)))
+    seconds = time.perf_counter() - started
+
+    with app.app_context(), db.engine.begin() as conn:
+        #any copy with more than one open rental is a double allocation
+        doubles = conn.execute(text("""
+            SELECT inventory_id, COUNT(*) AS open_rentals
+            FROM rental
+            WHERE rental_id > :max_rental AND return_date IS NULL
+            GROUP BY inventory_id
+            HAVING COUNT(*) > 1
+        """), {"max_rental": max_rental}).all()
+        #removing everything this round added
+        conn.execute(text("DELETE FROM rental WHERE rental_id > :max_rental"), {"max_rental": max_rental})
+        conn.execute(text("DELETE FROM inventory WHERE inventory_id IN :ids").bindparams(bindparam("ids", expanding = True)), {"ids": inventory_ids})
+
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    return seconds, counts, doubles
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Concurrent rental stress test")
+    parser.add_argument("--film", type = int, default = 1, help = "film_id every request rents")
+    parser.add_argument("--copies", type = int, default = 300, help = "extra copies added to store 1 for the test")
+    parser.add_argument("--requests", type = int, default = 400, help = "number of rental requests per mode")
+    parser.add_argument("--workers", type = int, default = 16, help = "requests in flight at once")
+    args = parser.parse_args()
+
+    for name, use_allocator in (("rental scan", False), ("allocator", True)):
+        seconds, counts, doubles = run(args.film, args.copies, args.requests, args.workers, use_allocator)
+        print(f"{name:12} {args.requests / seconds:8.1f} req/s  {counts.get(200, 0) / seconds:8.1f} rentals/s  statuses {counts}  double allocations {len(doubles)}")
+        for inventory_id, open_rentals in doubles:
+            print(f"    inventory {inventory_id} has {open_rentals} open rentals")
@@ -0,0 +1,91 @@
+from sqlalchemy import text #allows for SQL queries
+from bisect import bisect_left, insort #keeps the rankings sorted as counts change
+from heapq import nsmallest #for the handful of films a single actor is in
+import threading, time #the leaderboard is shared by every request thread
+
+class Leaderboard: #rental counters per film and film counters per actor, kept in memory so the homepage does not aggregate the rental table
+    def __init__(self, reconcile_interval = 300):
+        self.reconcile_interval = reconcile_interval #seconds between full recounts against the db, fixes drift from rentals made elsewhere
+        self.lock = threading.Lock()
+        self.updating = threading.Lock() #one thread recounts at a time, the rest keep serving the current numbers
+        self.built_at = None #monotonic time of the last recount, None means a recount is needed
+        self.loaded = False #True once the first recount finished, until then there is nothing to serve
+        self.film_titles = {} #film_id -> title
+        self.film_counts = {} #film_id -> number of rentals
+        self.film_ranking = [] #sorted (-rentals_count, film_id), the front of the list is the top films
+        self.actor_names = {} #actor_id -> "first last"
+        self.actor_films = {} #actor_id -> set of film_ids
+        self.actor_ranking = [] #sorted (-films_count, name, actor_id), the front of the list is the top actors
+
+    def build(self, conn): #recounts everything from the db and swaps the new numbers in
+        film_titles = dict(conn.execute(text("SELECT film_id, title FROM film")).all())
+        film_counts = dict.fromkeys(film_titles, 0)
+        for film_id, rentals_count in conn.execute(text("""
+            SELECT i.film_id, COUNT(r.rental_id) AS rentals_count
+            FROM inventory AS i
+            JOIN rental AS r ON r.inventory_id = i.inventory_id
+            GROUP BY i.film_id
+        """)):
+            if film_id in film_counts:
+                film_counts[film_id] = rentals_count
+        actor_names = {actor_id: f"{first_name} {last_name}" for actor_id, first_name, last_name in conn.execute(text("SELECT actor_id, first_name, last_name FROM actor"))}
+        actor_films = {}
+        for actor_id, film_id in conn.execute(text("SELECT actor_id, film_id FROM film_actor")):
+            if actor_id in actor_names:
+                actor_films.setdefault(actor_id, set()).add(film_id)
+        film_ranking = sorted((-count, film_id) for film_id, count in film_counts.items() if count) #films with no rentals never make the list, same as the inner join
+        actor_ranking = sorted((-len(films), actor_names[actor_id], actor_id) for actor_id, films in actor_films.items())
+        with self.lock:
+            self.film_titles, self.film_counts, self.film_ranking = film_titles, film_counts, film_ranking
+            self.actor_names, self.actor_films, self.actor_ranking = actor_names, actor_films, actor_ranking
+            self.built_at = time.monotonic()
+            self.loaded = True
+
+    def stale(self): #a recount is due
+        built_at = self.built_at
+        return built_at is None or time.monotonic() - built_at >= self.reconcile_interval
+
+    def ensure_fresh(self, conn): #builds on first use and recounts once the reconcile interval is up, one thread at a time
+        if not self.stale():
+            return
+        if not self.loaded: #nothing to serve yet, so every thread waits for the one doing the first build
+            with self.updating:
+                if self.stale():
+                    self.build(conn)
+            return
+        if not self.updating.acquire(blocking = False):
+            return #another thread is already recounting, this request gets the current numbers
+        try:
+            if self.stale():
+                self.build(conn)
+        finally:
+            self.updating.release()
+
+    def record_rental(self, film_id): #called after a rental commits, moves the film up by one
+        with self.lock:
+            if self.built_at is None:
+                return #nothing built yet, the first build will count this rental
+            if film_id not in self.film_counts:
+                self.built_at = None #a film added after the last build, recount on the next read
+                return
+            count = self.film_counts[film_id]
+            if count:
+                del self.film_ranking[bisect_left(self.film_ranking, (-count, film_id))]
+            self.film_counts[film_id] = count + 1
+            insort(self.film_ranking, (-(count + 1), film_id))
+
+    def top_films(self, conn, limit = 5): #same rows as the top 5 films query
+        self.ensure_fresh(conn)
+        with self.lock:
+            return [{"film_id": film_id, "title": self.film_titles[film_id], "rentals_count": -count} for count, film_id in self.film_ranking[:limit]]
+
+    def top_actors(self, conn, limit = 5): #same rows as the top 5 actors query
+        self.ensure_fresh(conn)
+        with self.lock:
+            return [{"actor_id": actor_id, "name": name, "films_count": -count} for count, name, actor_id in self.actor_ranking[:limit]]
+
+    def actor_top_films(self, conn, actor_id, limit = 5): #same rows as the top 5 films query on the actor page
+        self.ensure_fresh(conn)
+        with self.lock:
+            ranked = nsmallest(limit, ((-self.film_counts.get(film_id, 0), film_id) for film_id in self.actor_films.get(actor_id, ())))
+            return [{"film_id": film_id, "title": self.film_titles[film_id], "rentals_count": -count} for count, film_id in ranked if count]
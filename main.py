@@ -1,11 +1,25 @@
 from flask import Flask, jsonify, request #turns python objects into JSON for frontend, allows incoming http requests
+from flask import Response, stream_with_context #for streaming exports a chunk at a time
 from flask_sqlalchemy import SQLAlchemy #lets use use the MySQL db
-from sqlalchemy import text #allows for SQL queries
 from flask_cors import CORS #lets us communicate with react
 from dotenv import load_dotenv, find_dotenv #for env file used to run backend
 import os #used to read env variables
 from math import ceil #math ceiling function
 from datetime import datetime #for rental and return dates
+from bisect import bisect_right #for finding where a cursor starts in a sorted id list
+import base64, json #for encoding pagination cursors
+import csv, io #for CSV exports
+import threading, time #for the count cache
+from concurrent.futures import ThreadPoolExecutor #for running independent queries at the same time
+from search_index import SearchIndex, WILDCARDS #optional in-memory film search
+from leaderboard import Leaderboard #optional in-memory top 5 lists
+from availability import InventoryAllocator #optional in-memory free copy tracking
+import rental_stats #optional per-customer rental numbers table
+from response_cache import ResponseCache #optional cache for GET responses
+from metrics import Metrics #request and query timings for /api/metrics
+from queries import Queries #every SQL query, built with SQLAlchemy Core so it runs on MySQL and SQLite
+from admission import AdmissionControl, parse_class #optional per-route concurrency limits
+import payload #columnar list responses and optional gzip/brotli
 
 load_dotenv(find_dotenv()) #connection to mySQL db in env
 
@@ -25,109 +39,307 @@ CORS(app, resources={
 db_uri = os.getenv("DATABASE_URL") #getting the db connection from env
 app.config["SQLALCHEMY_DATABASE_URI"] = db_uri
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SEARCH_INDEX"] = os.getenv("SEARCH_INDEX", "0") == "1" #answer film searches from the in-memory index instead of LIKE scans
+app.config["LEADERBOARD"] = os.getenv("LEADERBOARD", "0") == "1" #answer the top 5 lists from in-memory counters instead of aggregating rentals
+app.config["RENTAL_STATS"] = os.getenv("RENTAL_STATS", "0") == "1" #read customer rental numbers from customer_rental_stats instead of scanning rentals, run flask rebuild-rental-stats first
+app.config["INVENTORY_ALLOCATOR"] = os.getenv("INVENTORY_ALLOCATOR", "0") == "1" #hand out free copies from memory with a row lock instead of scanning rentals
+app.config["RESPONSE_CACHE"] = os.getenv("RESPONSE_CACHE", "0") == "1" #serve repeat GETs from memory with ETags, rentals drop only the entries they change
+app.config["QUERY_FANOUT"] = os.getenv("QUERY_FANOUT", "0") == "1" #run the independent queries of a route at the same time on separate pooled connections
+app.config["METRICS"] = os.getenv("METRICS", "1") == "1" #time every route and statement, cheap enough to leave on
+app.config["ADMISSION_CONTROL"] = os.getenv("ADMISSION_CONTROL", "0") == "1" #limit how many heavy, detail and write requests run at once, turn the rest away with 429/503
+app.config["COMPRESSION"] = os.getenv("COMPRESSION", "0") == "1" #gzip or brotli for larger responses when the client accepts it, leave off behind a proxy that already compresses
 db = SQLAlchemy(app) #db object
+queries = Queries() #tables are reflected on the first query
+fanout_pool = ThreadPoolExecutor(max_workers = int(os.getenv("QUERY_FANOUT_WORKERS", "8")), thread_name_prefix = "fanout") #only used when QUERY_FANOUT is on
+search_index = SearchIndex(int(os.getenv("SEARCH_INDEX_REFRESH", "30")), int(os.getenv("SEARCH_INDEX_REBUILD", "600"))) #only used when SEARCH_INDEX is on
+leaderboard = Leaderboard(int(os.getenv("LEADERBOARD_RECONCILE", "300"))) #only used when LEADERBOARD is on
+allocator = InventoryAllocator(queries, int(os.getenv("INVENTORY_ALLOCATOR_REFRESH", "30"))) #only used when INVENTORY_ALLOCATOR is on
+response_cache = ResponseCache(int(os.getenv("RESPONSE_CACHE_TTL", "60")), int(os.getenv("RESPONSE_CACHE_ENTRIES", "2048")), int(os.getenv("RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024)))) #only used when RESPONSE_CACHE is on
+metrics = Metrics(int(os.getenv("SLOW_QUERY_MS", "200")), os.getenv("SLOW_QUERY_EXPLAIN", "0") == "1", os.getenv("SLOW_QUERY_PARAMS", "0") == "1") #only used when METRICS is on, the slow query log shows parameter types unless SLOW_QUERY_PARAMS is on
+admission = AdmissionControl(int(os.getenv("ADMISSION_TOTAL", "12")), { #only used when ADMISSION_CONTROL is on, each class is "limit,queue,wait_ms"
+    "heavy": parse_class(os.getenv("ADMISSION_HEAVY", "4,8,250"), 0), #aggregate searches, listings, top 5 lists and exports
+    "detail": parse_class(os.getenv("ADMISSION_DETAIL", "10,32,1000"), 1), #single and batch detail lookups
+    "write": parse_class(os.getenv("ADMISSION_WRITE", "6,32,2000"), 2), #rentals, first in line for a free slot
+})
+compression = payload.Compression(int(os.getenv("COMPRESSION_MIN_BYTES", "1024")), int(os.getenv("GZIP_LEVEL", "6")), int(os.getenv("BROTLI_QUALITY", "5"))) #only used when COMPRESSION is on
+compression.install(app)
+
+def cache_metric_lines(): #response cache counters for /api/metrics
+    stats = response_cache.stats()
+    lines = []
+    for name, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("entries", "gauge"), ("bytes", "gauge")):
+        metric = f"app_response_cache_{name}" + ("_total" if kind == "counter" else "")
+        lines += [f"# TYPE {metric} {kind}", f"{metric} {stats[name]}"]
+    return lines
+
+with app.app_context(): #db.engine needs an app context
+    queries.bind(db.engine)
+    if app.config["METRICS"]:
+        metrics.instrument(app, db.engine)
+if app.config["METRICS"]:
+    metrics.collectors.append(cache_metric_lines)
+    metrics.collectors.append(admission.metric_lines)
+
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", "60")) #seconds a search total is reused before it is counted again
+COUNT_CACHE_SIZE = 1024 #max number of filter sets we keep totals for
+count_cache = {} #(route, filters) -> (expires at, total)
+count_cache_lock = threading.Lock() #flask can serve requests on several threads
+
+def cached_count(conn, route, filters, count_sql, sql_params): #returns the total rows for a filter set, only running COUNT(*) when the cached value is missing or expired
+    key = (route, tuple(sorted(filters.items())))
+    now = time.monotonic()
+    with count_cache_lock:
+        hit = count_cache.get(key)
+    if hit and hit[0] > now:
+        return hit[1] #still fresh, no need to count again
+    total = conn.execute(count_sql, sql_params).scalar() #getting number of results
+    with count_cache_lock:
+        count_cache.pop(key, None) #re-inserting moves the key to the end so the oldest filter set is dropped first
+        count_cache[key] = (now + COUNT_CACHE_TTL, total)
+        while len(count_cache) > COUNT_CACHE_SIZE:
+            count_cache.pop(next(iter(count_cache)))
+    return total
+
+def fan_out(*tasks): #runs functions that each take a connection and returns their results in order, a None task just gives None
+    engine = db.engine #read in the request thread, the pool threads have no app context
+    real = [task for task in tasks if task is not None]
+    if not app.config["QUERY_FANOUT"] or len(real) < 2:
+        with engine.connect() as conn: #connecting to the db, one connection and one query after another
+            results = iter([task(conn) for task in real])
+    else:
+        route = getattr(metrics.local, "route", None) #so statements in the pool threads are counted for this route
+        def run(task): #one task on its own pooled connection
+            metrics.local.route = route
+            with engine.connect() as conn:
+                return task(conn)
+        futures = [fanout_pool.submit(run, task) for task in real] #the request thread holds no connection while it waits, so the pool cannot deadlock
+        results = iter([future.result() for future in futures])
+    return [None if task is None else next(results) for task in tasks]
+
+def encode_cursor(last_id, filters): #turns the last id on a page and the filters used into an opaque token for the next page
+    raw = json.dumps({"last": last_id, "filters": filters}, sort_keys = True, separators = (",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(token, filters, parse = int): #returns the last id inside a cursor, or None if the token is broken or was made for different filters
+    if not token:
+        return 0 #empty cursor means start from the first row
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        last_id = parse(data["last"]) #an int id, or whatever parse turns the stored key into
+    except (ValueError, TypeError, KeyError, IndexError): #bad base64, bad JSON or missing id
+        return None
+    if data.get("filters") != filters:
+        return None #cursor belongs to a different search
+    return last_id
+
+@app.cli.command("rebuild-rental-stats") #flask --app main rebuild-rental-stats
+def rebuild_rental_stats(): #backfills customer_rental_stats from the rental table and installs the triggers that keep it in step
+    with db.engine.begin() as conn: #one transaction so readers never see a half filled table
+        rental_stats.rebuild(conn)
+    print("customer_rental_stats rebuilt")
+
+def customer_tags(args, data): #cache tags for customer listings, one per customer on the page so a rental only drops the pages showing that customer
+    return [f"customer:{customer_id}" for customer_id in payload.column(data["items"], "customer_id")]
+
+def invalidate_rentals(rentals): #drops the cached responses a committed rental changed, rentals is a list of (customer_id, film_id)
+    if not app.config["RESPONSE_CACHE"]:
+        return
+    film_ids = sorted({film_id for _, film_id in rentals})
+    with db.engine.connect() as conn: #connecting to the db, actor pages show rental counts of their films
+        actor_ids = conn.execute(queries.get("film_actor_ids"), {"film_ids": film_ids}).scalars().all()
+    response_cache.invalidate(
+        "top5_films", #rental counts moved
+        *[f"film:{film_id}" for film_id in film_ids], #available copies and rental count
+        *[f"actor:{actor_id}" for actor_id in actor_ids], #the actor's top films
+        *{f"customer:{customer_id}" for customer_id, _ in rentals} #current rentals and totals
+    )
+
+@app.get("/api/metrics") #Prometheus scrape endpoint
+def metrics_text(): #function for returning every metric in Prometheus text format
+    if not app.config["METRICS"]:
+        return jsonify({"ok": False, "error": "Metrics are turned off."}), 404
+    return Response(metrics.render(), mimetype = "text/plain; version=0.0.4")
+
+@app.get("/api/cache") #cache counters, for checking the hit rate
+def cache_stats(): #function for returning the response cache counters
+    return jsonify(response_cache.stats())
+
+@app.get("/api/admission") #admission control counters, for checking queue depth and rejections
+def admission_stats(): #function for returning running, waiting, admitted and rejected requests per cost class
+    return jsonify(admission.stats())
+
+def top5_cost(): #the top 5 lists aggregate every rental unless the leaderboard answers them from memory
+    return "detail" if app.config["LEADERBOARD"] else "heavy"
+
+def search_cost(): #LIKE '%x%' cannot use an index, so every filtered film search is a full scan unless the search index answers it
+    values = [request.args.get(name, "", type = str).strip() for name in ("title", "actor", "genre")]
+    if not any(values):
+        return "detail" #no filters is one page in film_id order
+    if app.config["SEARCH_INDEX"] and not any(w in value for value in values for w in WILDCARDS):
+        return "detail" #matched in memory, SQL only loads the page by id
+    return "heavy"
+
+def wants_total(): #cursor pages only count the results when the client asks for it
+    return request.args.get("includeTotal", "", type = str).strip().lower() in ("1", "true")
+
+def wants_columnar(): #list routes send column names once and value arrays with ?format=columnar
+    return request.args.get("format", "", type = str).strip().lower() == "columnar"
+
+def list_items(rows, sql): #rows as a list of objects, or columnar when the client asked for it
+    if wants_columnar():
+        return payload.columnar(rows, sql.selected_columns.keys()) #columns come from the statement so an empty page still has them
+    return [dict(r) for r in rows]
+
+def respond(data): #columnar bodies skip jsonify for the faster encoder, dates come out as ISO 8601 there
+    return payload.response(data) if wants_columnar() else jsonify(data)
 
 #As a user I want to view top 5 rented films of all time
 @app.get("/api/films/top5") #route to homepage
+@response_cache.cached(lambda args, data: ["top5_films"])
+@admission.limit(top5_cost)
 def top5_films(): #function for getting the top 5 films
 
-    sql = text("""
-        SELECT f.film_id, f.title, COUNT(r.rental_id) AS rentals_count
-        FROM film AS f
-        JOIN inventory i ON i.film_id = f.film_id
-        JOIN rental r ON r.inventory_id = i.inventory_id
-        GROUP BY f.film_id, f.title
-        ORDER BY rentals_count DESC
-        LIMIT 5;
-    """)
+    if app.config["LEADERBOARD"]:
+        with db.engine.connect() as conn: #connecting to the db, only used if the leaderboard needs a recount
+            return jsonify(leaderboard.top_films(conn))
+
     with db.engine.connect() as conn: #connecting to the db
-        rows = conn.execute(sql).mappings().all() #executing the query
+        rows = conn.execute(queries.get("top5_films")).mappings().all() #executing the query
     return jsonify([dict(r) for r in rows]) #getting the rows and putting them into a dictionary
 
 #As a user I want to be able to view top 5 actors that are part of films I have in the store
 @app.get("/api/actors/top5")
+@response_cache.cached() #only changes when film_actor does, so it just expires
+@admission.limit(top5_cost)
 def top5_actors(): #function for getting the top 5 actors based on movie count
 
-    sql = text("""                     
-        SELECT a.actor_id, CONCAT(a.first_name, ' ', a.last_name) AS name, COUNT(DISTINCT fa.film_id) AS films_count
-        FROM actor AS a
-        JOIN film_actor fa ON fa.actor_id = a.actor_id
-        GROUP BY a.actor_id, name
-        ORDER BY films_count DESC, name ASC
-        LIMIT 5;
-    """)
+    if app.config["LEADERBOARD"]:
+        with db.engine.connect() as conn: #connecting to the db, only used if the leaderboard needs a recount
+            return jsonify(leaderboard.top_actors(conn))
+
     with db.engine.connect() as conn: #connecting to the db
-        rows = conn.execute(sql).mappings().all() #executing the query
+        rows = conn.execute(queries.get("top5_actors")).mappings().all() #executing the query
     return jsonify([dict(r) for r in rows]) #getting the rows and putting them into a dictionary
 
 #As a user I want to be able to click on any of the top 5 films and view its details
 @app.get("/api/films/<int:film_id>") #using the end of the URL as the film's ID
+@response_cache.cached(lambda args, data: [f"film:{args['film_id']}"])
+@admission.limit("detail")
 def film_details(film_id): #function for getting a film's information
 
     store_id = 1 #using only store with ID of 1 for simplicity sake
 
-    sql = text("""
-        -- getting film information
-        SELECT f.film_id AS id, f.title, f.description, f.release_year, GROUP_CONCAT(DISTINCT c.name ORDER BY c.name SEPARATOR ', ') AS categories,
-        l.name AS language, f.rental_duration, f.rental_rate, f.length AS duration, f.replacement_cost, f.rating, f.special_features, f.last_update,
-        (SELECT COUNT(*) FROM inventory AS i WHERE i.film_id = f.film_id AND i.store_id = :store_id) AS total_copies,
-        (SELECT COUNT(*) FROM inventory AS i LEFT JOIN rental AS r ON r.inventory_id = i.inventory_id AND r.return_date IS NULL
-        WHERE i.film_id = f.film_id AND i.store_id = :store_id AND r.rental_id IS NULL) AS available_copies,
-        (SELECT COUNT(*) FROM rental AS r JOIN inventory i2 ON i2.inventory_id = r.inventory_id WHERE i2.film_id = f.film_id) AS rentals_count
-        FROM film AS f
-        JOIN language AS l ON l.language_id = f.language_id
-        LEFT JOIN film_category AS fc ON fc.film_id   = f.film_id
-        LEFT JOIN category AS c ON c.category_id = fc.category_id
-        WHERE f.film_id = :film_id -- film_id from URL
-        GROUP BY
-        f.film_id, f.title, f.description, f.release_year, l.name, f.rental_duration, f.rental_rate, f.length, f.replacement_cost, f.rating, f.special_features, f.last_update;
-    """)
-    actors_sql = text("""
-        -- getting actor information to display actors involved when clicking on a film
-        SELECT a.actor_id, CONCAT(a.first_name, ' ', a.last_name) AS name
-        FROM actor AS a
-        JOIN film_actor fa ON fa.actor_id = a.actor_id
-        WHERE fa.film_id = :film_id -- film_id from URL
-        ORDER BY name;
-    """)
-    with db.engine.connect() as conn: #connecting to the db
-        film = conn.execute(sql, {"film_id": film_id, "store_id": store_id}).mappings().first() #executing query with film_id from URL as parameter, and store_id as 1 to avoid confusion
-        actors = conn.execute(actors_sql, {"film_id": film_id}).mappings().all() #executing query with film_id from URL as parameter
+    sql = queries.get("film_details", app.config["INVENTORY_ALLOCATOR"]) #free copies come from the allocator when it is on, otherwise they are counted with the rental table
+    film, actors, available = fan_out(
+        lambda conn: conn.execute(sql, {"film_id": film_id, "store_id": store_id}).mappings().first(), #executing query with film_id from URL as parameter, and store_id as 1 to avoid confusion
+        lambda conn: conn.execute(queries.get("film_actors"), {"film_id": film_id}).mappings().all(), #executing query with film_id from URL as parameter
+        (lambda conn: allocator.available(conn, film_id, store_id)) if app.config["INVENTORY_ALLOCATOR"] else None #same pool rentals are taken from
+    )
     data = dict(film) #getting the rows and putting them into a dictionary
+    if available is not None:
+        data["available_copies"] = available
     data["actors"] = [dict(r) for r in actors] #adding the actors to the dictionary as well
     return jsonify(data) #converting the data found into JSON format
 
 #As a user I want to be able to view the actor’s details and view their top 5 rented films
 @app.get("/api/actors/<int:actor_id>") #using the end of the URL as the actor's ID
+@response_cache.cached(lambda args, data: [f"actor:{args['actor_id']}"])
+@admission.limit("detail")
 def actor_details(actor_id): #function for getting an actor's information
 
-    info_sql = text("""  
-        SELECT a.actor_id, CONCAT(a.first_name, ' ', a.last_name) AS name, COUNT(DISTINCT fa.film_id) AS films_count
-        FROM actor AS a
-        LEFT JOIN film_actor AS fa ON fa.actor_id = a.actor_id
-        WHERE a.actor_id = :actor_id -- actor_id from URL
-        GROUP BY a.actor_id, name;
-    """)
-    top5_films_sql = text("""
-        SELECT f.film_id, f.title, COUNT(r.rental_id) AS rentals_count
-        FROM film AS f
-        JOIN film_actor AS fa ON fa.film_id = f.film_id
-        JOIN inventory AS i ON i.film_id = f.film_id
-        JOIN rental AS r ON r.inventory_id = i.inventory_id
-        WHERE fa.actor_id = :actor_id -- actor_id from URL
-        GROUP BY f.film_id, f.title
-        ORDER BY rentals_count DESC
-        LIMIT 5;
-    """)
-    with db.engine.connect() as conn: #connecting to the db
-        info = conn.execute(info_sql, {"actor_id": actor_id}).mappings().first() #executing query with actor_id from URL as parameter
-        top_films = conn.execute(top5_films_sql, {"actor_id": actor_id}).mappings().all() #executing query with actor_id from URL as parameter
+    info, top_films = fan_out(
+        lambda conn: conn.execute(queries.get("actor_info"), {"actor_id": actor_id}).mappings().first(), #executing query with actor_id from URL as parameter
+        lambda conn: leaderboard.actor_top_films(conn, actor_id) if app.config["LEADERBOARD"] #counted in memory instead of joining every rental
+        else conn.execute(queries.get("actor_top_films"), {"actor_id": actor_id}).mappings().all() #executing query with actor_id from URL as parameter
+    )
     data = dict(info) #getting the rows and putting them into a dictionary
     data["top_films"] = [dict(r) for r in top_films] #adding the top films to the dictionary as well
     return jsonify(data) #converting the data found into JSON format
 
+BATCH_IDS_LIMIT = 100 #most ids one batch request can ask for
+
+def parse_ids(): #reads ?ids=1,2,3 (or repeated ids=) into a list of unique ints in the order given, None if any id is not a number
+    ids = []
+    for value in request.args.getlist("ids"):
+        for part in value.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            if not part.isdigit():
+                return None
+            if int(part) not in ids:
+                ids.append(int(part))
+    return ids
+
+#As a user I want to load the details of many films at once, for example every card on a search page
+@app.get("/api/films") #endpoint for /api/films?ids=1,2,3
+@response_cache.cached(lambda args, data: [f"film:{r['id']}" for r in data])
+@admission.limit("detail")
+def films_batch(): #function for getting the same details as film_details for many films in three queries
+
+    store_id = 1 #using only store with ID of 1 for simplicity sake
+    film_ids = parse_ids()
+    if film_ids is None:
+        return jsonify({"ok": False, "error": "ids must be a comma separated list of numbers."}), 400
+    if len(film_ids) > BATCH_IDS_LIMIT:
+        return jsonify({"ok": False, "error": f"At most {BATCH_IDS_LIMIT} ids per request."}), 400
+    if not film_ids:
+        return jsonify([])
+
+    film_rows, count_rows, actor_rows, available = fan_out(
+        lambda conn: conn.execute(queries.get("films_batch"), {"film_ids": film_ids}).mappings().all(), #same columns as film_details without the counts
+        lambda conn: conn.execute(queries.get("film_counts_batch"), {"film_ids": film_ids, "store_id": store_id}).mappings().all(), #copies, free copies and rentals in one pass
+        lambda conn: conn.execute(queries.get("film_actors_batch"), {"film_ids": film_ids}).mappings().all(), #actors of every film, grouped by film below
+        (lambda conn: allocator.available_many(conn, film_ids, store_id)) if app.config["INVENTORY_ALLOCATOR"] else None #same pool rentals are taken from, missing pools load in one query
+    )
+    films = {r["id"]: dict(r) for r in film_rows}
+    counts = {r["film_id"]: r for r in count_rows}
+    actors = {}
+    for r in actor_rows:
+        actors.setdefault(r["film_id"], []).append({"actor_id": r["actor_id"], "name": r["name"]})
+    for film_id, data in films.items():
+        count = counts.get(film_id) #films with no copies have no row
+        data["total_copies"] = count["total_copies"] if count else 0
+        data["available_copies"] = available[film_id] if available is not None else count["available_copies"] if count else 0
+        data["rentals_count"] = count["rentals_count"] if count else 0
+        data["actors"] = actors.get(film_id, [])
+    return jsonify([films[film_id] for film_id in film_ids if film_id in films]) #same order as the ids asked for, unknown ids are left out
+
+#As a user I want to load the details of many actors at once
+@app.get("/api/actors") #endpoint for /api/actors?ids=1,2,3
+@response_cache.cached(lambda args, data: [f"actor:{r['actor_id']}" for r in data])
+@admission.limit("detail")
+def actors_batch(): #function for getting the same details as actor_details for many actors in two queries
+
+    actor_ids = parse_ids()
+    if actor_ids is None:
+        return jsonify({"ok": False, "error": "ids must be a comma separated list of numbers."}), 400
+    if len(actor_ids) > BATCH_IDS_LIMIT:
+        return jsonify({"ok": False, "error": f"At most {BATCH_IDS_LIMIT} ids per request."}), 400
+    if not actor_ids:
+        return jsonify([])
+
+    info_rows, film_rows = fan_out(
+        lambda conn: conn.execute(queries.get("actors_batch"), {"actor_ids": actor_ids}).mappings().all(),
+        lambda conn: {actor_id: leaderboard.actor_top_films(conn, actor_id) for actor_id in actor_ids} if app.config["LEADERBOARD"] #counted in memory instead of joining every rental
+        else conn.execute(queries.get("actor_films_batch"), {"actor_ids": actor_ids}).mappings().all() #every film of every actor, the top 5 per actor are picked below
+    )
+    actors = {r["actor_id"]: dict(r) for r in info_rows}
+    if app.config["LEADERBOARD"]:
+        for actor_id, data in actors.items():
+            data["top_films"] = film_rows[actor_id]
+    else:
+        films = {}
+        for r in film_rows:
+            films.setdefault(r["actor_id"], []).append({"film_id": r["film_id"], "title": r["title"], "rentals_count": r["rentals_count"]})
+        for actor_id, data in actors.items():
+            data["top_films"] = sorted(films.get(actor_id, []), key = lambda f: (-f["rentals_count"], f["film_id"]))[:5]
+    return jsonify([actors[actor_id] for actor_id in actor_ids if actor_id in actors]) #same order as the ids asked for, unknown ids are left out
+
 #As a user I want to be able to search a film by name of film, name of an actor, or genre of the film
 @app.get("/api/films/search") #endpoint for searching for films
+@response_cache.cached() #search results do not depend on rentals, so they just expire
+@admission.limit(search_cost)
 def films_search(): #function for searching for a film
 
     title = request.args.get("title", "", type = str).strip() #getting title from URL, blank if not found
@@ -138,101 +350,109 @@ def films_search(): #function for searching for a film
     page = max(request.args.get("page", 1, type = int), 1) #ensuring page is not out of bounds
     page_size = min(max(request.args.get("pageSize", 20, type = int), 1), 50) #20 movies at a time per page
 
-    where = [] #array of SQL conditions
     sql_params = {} #used for parameters within SQL queries
-
     if title: #if a title is found
-        where.append("f.title LIKE :title")
         sql_params["title"] = f"%{title}%" #parameter for SQL, partial matching allowed
-
     if actor: #if an actor is found
-        #connecting actor to film_actor for searching
-        where.append("""
-            EXISTS (
-            SELECT 1
-            FROM film_actor AS fa
-            JOIN actor AS a ON a.actor_id = fa.actor_id
-            WHERE fa.film_id = f.film_id
-            AND CONCAT(a.first_name, ' ', a.last_name) LIKE :actor)
-        """)
         sql_params["actor"] = f"%{actor}%" #parameter for SQL, partial matching allowed
-
     if genre: #if a genre is found
-        #searching if a film matches the current genre
-        where.append("""
-            EXISTS (
-            SELECT 1
-            FROM film_category AS fc
-            JOIN category AS c ON c.category_id = fc.category_id
-            WHERE fc.film_id = f.film_id
-            AND c.name LIKE :genre)
-        """)
         sql_params["genre"] = f"%{genre}%" #parameter for SQL, partial matching allowed
 
-    where_sql = "WHERE " + " AND ".join(where) if where else "" #combining all search features from user if present
-    count = text(f"SELECT COUNT(*) FROM film AS f {where_sql}") #amount of rows returned from search
-
-    #query to get films with parameters from user, uses offset to show different pages of films
-    film_sql = text(f"""
-        SELECT f.film_id, f.title, f.release_year, f.rating, f.length, GROUP_CONCAT(DISTINCT c.name ORDER BY c.name SEPARATOR ', ') AS categories
-        FROM film AS f
-        LEFT JOIN film_category AS fc ON fc.film_id = f.film_id
-        LEFT JOIN category AS c ON c.category_id = fc.category_id
-        {where_sql}
-        GROUP BY f.film_id, f.title, f.release_year, f.rating, f.length
-        ORDER BY f.film_id ASC
-        LIMIT :limit OFFSET :offset
-    """)
-    with db.engine.connect() as conn: #connecting to the db
-        total = conn.execute(count, sql_params).scalar() #getting number of results
-        rows = conn.execute(film_sql, {**sql_params, "limit": page_size, "offset": (page - 1) * page_size}).mappings().all() #displaying a reasonable number of rows
-
-    return jsonify({ #JSON response for frontend to read
+    filters = {"title": title, "actor": actor, "genre": genre} #filters the cursor is tied to
+    searched = (bool(title), bool(actor), bool(genre)) #which search fields are in the query, each combination is its own prebuilt statement
+    count = queries.get("films_search_count", *searched) #amount of rows returned from search
+
+    cursor_mode = "cursor" in request.args #new clients send ?cursor= (empty for the first page), old clients keep using page
+    if cursor_mode:
+        last_id = decode_cursor(request.args.get("cursor", "", type = str).strip(), filters)
+        if last_id is None:
+            return jsonify({"ok": False, "error": "Invalid cursor for this search."}), 400
+    count_params = dict(sql_params) #the total does not depend on the cursor
+
+    index_ids = None #sorted film_ids from the search index, None when SQL does the filtering
+    if app.config["SEARCH_INDEX"] and any(searched):
+        with db.engine.connect() as conn: #connecting to the db, only used if the index needs building or refreshing
+            index_ids = search_index.search(conn, title, actor, genre)
+
+    limit = page_size + 1 if cursor_mode else page_size #in cursor mode one extra row tells us if there is a next page
+    offset = 0 if cursor_mode else (page - 1) * page_size
+    if index_ids is not None: #the index already knows which films match, SQL only loads the rows for this page
+        start = bisect_right(index_ids, last_id) if cursor_mode else offset
+        film_sql = queries.get("films_by_ids")
+        sql_params = {"ids": index_ids[start:start + limit]}
+        offset = 0
+    else: #uses offset or the cursor to show different pages of films
+        film_sql = queries.get("films_search", *searched, cursor_mode) #the cursor seeks past the last film instead of skipping rows with offset
+        if cursor_mode:
+            sql_params["last_id"] = last_id
+
+    if index_ids is not None:
+        count_task = None
+        total = len(index_ids) #the index gives the total for free
+    elif cursor_mode and not wants_total():
+        count_task = None
+        total = None #cursor clients that did not ask for a total skip the count
+    else:
+        count_task = lambda conn: cached_count(conn, "films_search", filters, count, count_params) #getting number of results
+    rows, counted = fan_out(
+        lambda conn: conn.execute(film_sql, {**sql_params, "limit": limit, "offset": offset}).mappings().all(), #displaying a reasonable number of rows
+        count_task
+    )
+    if count_task is not None:
+        total = counted
+
+    if cursor_mode:
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        body = {
+            "pageSize": page_size,
+            "items": list_items(rows, film_sql),
+            "nextCursor": encode_cursor(rows[-1]["film_id"], filters) if more else None
+        }
+        if total is not None:
+            body["total"] = total
+        return respond(body)
+
+    return respond({ #JSON response for frontend to read
         "total": total,
         "totalPages": ceil(total/page_size), #need a whole number so use ceiling
         "page": page,
         "pageSize": page_size,
-        "items": [dict(r) for r in rows]
+        "items": list_items(rows, film_sql),
+        "nextCursor": encode_cursor(rows[-1]["film_id"], filters) if rows and page * page_size < total else None #lets old clients switch to cursor paging
     })
 
 #As a user I want to view a list of all customers (Pref. using pagination)
 #this one is no longer in use since below is the updated endpoint with search functionality
 @app.get("/api/customers") #endpoint for customer page
+@response_cache.cached(customer_tags)
+@admission.limit("heavy")
 def customers_list(): #function for returning customers
 
     #pagination
     page = max(request.args.get("page", 1, type = int), 1) #ensuring page is not out of bounds
     page_size = min(max(request.args.get("pageSize", 20, type = int), 1), 50) #20 customers at a time per page
 
-    count = text("SELECT COUNT(*) FROM customer") #amount of rows returned from search
-
-    #customer information
-    sql = text("""
-        SELECT c.customer_id, c.store_id, c.first_name, c.last_name, c.email, c.active, a.address, a.address2, a.district, ci.city, co.country,
-        (SELECT COUNT(*) FROM rental AS r WHERE r.customer_id = c.customer_id) AS total_rentals,
-        (SELECT COUNT(*) FROM rental AS r WHERE r.customer_id = c.customer_id AND r.return_date IS NULL) AS current_rentals,
-        (SELECT MAX(rental_date) FROM rental AS r WHERE r.customer_id = c.customer_id) AS last_rental_date
-        FROM customer AS c
-        JOIN address AS a ON a.address_id = c.address_id
-        JOIN city AS ci ON ci.city_id = a.city_id
-        JOIN country AS co ON co.country_id = ci.country_id
-        ORDER BY c.customer_id
-        LIMIT :limit OFFSET :offset
-    """)
-    with db.engine.connect() as conn: #connecting to the db
-        total = conn.execute(count).scalar() #getting number of results
-        rows = conn.execute(sql, {"limit": page_size, "offset": (page - 1) * page_size}).mappings().all() #displaying a reasonable number of rows
+    count = queries.get("customers_count") #amount of rows returned from search
+    sql = queries.get("customers_page", app.config["RENTAL_STATS"]) #customer information, rental numbers from the rollup or from the rental table
 
-    return jsonify({ #JSON response for frontend to read
+    total, rows = fan_out(
+        lambda conn: conn.execute(count).scalar(), #getting number of results
+        lambda conn: conn.execute(sql, {"limit": page_size, "offset": (page - 1) * page_size}).mappings().all() #displaying a reasonable number of rows
+    )
+
+    return respond({ #JSON response for frontend to read
         "total": total,
         "totalPages": ceil(total/page_size), #need a whole number so use ceiling
         "page": page,
         "pageSize": page_size,
-        "items": [dict(r) for r in rows]
+        "items": list_items(rows, sql)
     })
 
 #As a user I want the ability to filter/search customers by their customer id, first name or last name.
 @app.get("/api/customers/search") #endpoint for searching for customers
+@response_cache.cached(customer_tags)
+@admission.limit("heavy")
 def customers_search(): #function for searching for customers
 
     customer_id = request.args.get("customer_id", "", type = str).strip() #getting customer id from URL, blank if not found
@@ -243,93 +463,157 @@ def customers_search(): #function for searching for customers
     page = max(request.args.get("page", 1, type = int), 1) #ensuring page is not out of bounds
     page_size = min(max(request.args.get("pageSize", 20, type = int), 1), 50) #20 customers at a time per page
 
-    where = [] #array of SQL conditions
     sql_params = {} #used for parameters within SQL queries
-
     if first_name: #if a first name is found
-        where.append("c.first_name LIKE :first")
         sql_params["first"] = f"%{first_name}%" #parameter for SQL, partial matching allowed
-
     if last_name: #if a last name is found
-        where.append("c.last_name LIKE :last")
         sql_params["last"] = f"%{last_name}%" #parameter for SQL, partial matching allowed
-
     if customer_id: #if a customer id is found
-        where.append("c.customer_id = :customer_id") #parameter for SQL, no partial matching allowed since this is an id
-        sql_params["customer_id"] = int(customer_id)
-
-    where_sql = "WHERE " + " AND ".join(where) if where else "" #combining all search features from user if present
-    count = text(f"SELECT COUNT(*) FROM customer AS c {where_sql}") #amount of rows returned from search
-
-    #query to get customers with parameters from user, uses offset to show different pages of customers
-    customer_sql = text(f"""
-        SELECT c.customer_id, c.store_id, c.first_name, c.last_name, c.email, c.active, a.address, a.address2, a.district, ci.city, co.country,
-        (SELECT COUNT(*) FROM rental AS r WHERE r.customer_id = c.customer_id) AS total_rentals,
-        (SELECT COUNT(*) FROM rental AS r WHERE r.customer_id = c.customer_id AND r.return_date IS NULL) AS current_rentals,
-        (SELECT MAX(rental_date) FROM rental AS r WHERE r.customer_id = c.customer_id) AS last_rental_date
-        FROM customer AS c
-        JOIN address AS a ON a.address_id = c.address_id
-        JOIN city AS ci ON ci.city_id = a.city_id
-        JOIN country AS co ON co.country_id = ci.country_id
-        {where_sql}
-        ORDER BY c.customer_id
-        LIMIT :limit OFFSET :offset
-    """)
-    with db.engine.connect() as conn: #connecting to the db
-        total = conn.execute(count, sql_params).scalar() #getting number of results
-        rows = conn.execute(customer_sql, {**sql_params, "limit": page_size, "offset": (page - 1) * page_size}).mappings().all() #displaying a reasonable number of rows
+        sql_params["customer_id"] = int(customer_id) #no partial matching allowed since this is an id
+
+    filters = {"customer_id": customer_id, "first_name": first_name, "last_name": last_name} #filters the cursor is tied to
+    searched = (bool(first_name), bool(last_name), bool(customer_id)) #which search fields are in the query, each combination is its own prebuilt statement
+    count = queries.get("customers_search_count", *searched) #amount of rows returned from search
+
+    cursor_mode = "cursor" in request.args #new clients send ?cursor= (empty for the first page), old clients keep using page
+    if cursor_mode:
+        last_id = decode_cursor(request.args.get("cursor", "", type = str).strip(), filters)
+        if last_id is None:
+            return jsonify({"ok": False, "error": "Invalid cursor for this search."}), 400
+        sql_params["last_id"] = last_id #seeking past the last customer instead of skipping rows with offset
+
+    #query to get customers with parameters from user, uses offset or the cursor to show different pages of customers
+    customer_sql = queries.get("customers_search", *searched, cursor_mode, app.config["RENTAL_STATS"]) #rental numbers from the rollup or from the rental table
+    count_params = {k: v for k, v in sql_params.items() if k != "last_id"} #the total does not depend on the cursor
+
+    if cursor_mode:
+        rows, total = fan_out(
+            lambda conn: conn.execute(customer_sql, {**sql_params, "limit": page_size + 1, "offset": 0}).mappings().all(), #one extra row tells us if there is a next page
+            (lambda conn: cached_count(conn, "customers_search", filters, count, count_params)) if wants_total() else None
+        )
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        body = {
+            "pageSize": page_size,
+            "items": list_items(rows, customer_sql),
+            "nextCursor": encode_cursor(rows[-1]["customer_id"], filters) if more else None
+        }
+        if total is not None:
+            body["total"] = total
+        return respond(body)
+
+    total, rows = fan_out(
+        lambda conn: cached_count(conn, "customers_search", filters, count, count_params), #getting number of results
+        lambda conn: conn.execute(customer_sql, {**sql_params, "limit": page_size, "offset": (page - 1) * page_size}).mappings().all() #displaying a reasonable number of rows
+    )
     
-    return jsonify({ #JSON response for frontend to read
+    return respond({ #JSON response for frontend to read
         "total": total,
         "totalPages": ceil(total/page_size), #need a whole number so use ceiling
         "page": page,
         "pageSize": page_size,
-        "items": [dict(r) for r in rows]
+        "items": list_items(rows, customer_sql),
+        "nextCursor": encode_cursor(rows[-1]["customer_id"], filters) if rows and page * page_size < total else None #lets old clients switch to cursor paging
     })
 
 #As a user I want to be able to view customer details and see their past and present rental history
 @app.get("/api/customers/<int:customer_id>")
+@response_cache.cached(lambda args, data: [f"customer:{args['customer_id']}"])
+@admission.limit("detail")
 def customer_details(customer_id): #function for getting a customer's details
 
-    #query to get current customer's information
-    info_sql = text("""
-        SELECT c.customer_id, c.store_id, c.first_name, c.last_name, c.email, c.active, a.address, a.address2, a.district, ci.city, co.country, c.create_date
-        FROM customer AS c
-        JOIN address AS a ON a.address_id = c.address_id
-        JOIN city AS ci ON ci.city_id = a.city_id
-        JOIN country AS co ON co.country_id = ci.country_id
-        WHERE c.customer_id = :customer_id
-    """)
-    #query to get present rentals of current customer
-    present_sql = text("""
-        SELECT r.rental_id, r.inventory_id, r.rental_date, f.film_id, f.title, f.rental_duration, DATE_ADD(r.rental_date, INTERVAL f.rental_duration DAY) AS due_date
-        FROM rental AS r
-        JOIN inventory AS i ON i.inventory_id = r.inventory_id
-        JOIN film AS f ON f.film_id = i.film_id
-        WHERE r.customer_id = :customer_id AND r.return_date IS NULL
-        ORDER BY r.rental_date DESC
-    """)
     #query to get past rentals of current customer
-    past_sql = text("""
-        SELECT r.rental_id, r.inventory_id, r.rental_date, r.return_date, f.film_id, f.title, TIMESTAMPDIFF(DAY, r.rental_date, r.return_date) AS days_out
-        FROM rental AS r
-        JOIN inventory AS i ON i.inventory_id = r.inventory_id
-        JOIN film AS f ON f.film_id = i.film_id
-        WHERE r.customer_id = :customer_id AND r.return_date IS NOT NULL
-        ORDER BY r.rental_date DESC
-        LIMIT 1000
-    """)
-    with db.engine.connect() as conn: #connecting to the db
-        info = conn.execute(info_sql, {"customer_id": customer_id}).mappings().first() #executing query with customer_id from URL as parameter
-        present = conn.execute(present_sql, {"customer_id": customer_id}).mappings().all() #executing query with customer_id from URL as parameter
-        past = conn.execute(past_sql, {"customer_id": customer_id}).mappings().all() #executing query with customer_id from URL as parameter
+    #history is paged newest first with a (rental_date, rental_id) cursor instead of stopping at 1000 rows
+    history_size = min(max(request.args.get("historyPageSize", 1000, type = int), 1), 1000) #1000 rentals at a time like before
+    history_params = {"customer_id": customer_id, "limit": history_size + 1} #one extra row tells us if there is an older page
+    history_cursor = request.args.get("historyCursor", "", type = str).strip()
+    if history_cursor:
+        before = decode_cursor(history_cursor, {"customer_id": customer_id}, lambda last: (datetime.fromisoformat(last[0]), int(last[1])))
+        if before is None:
+            return jsonify({"ok": False, "error": "Invalid history cursor for this customer."}), 400
+        history_params["before_date"], history_params["before_id"] = before #seeking past the last rental shown
+    past_sql = queries.get("customer_history", bool(history_cursor))
+    info, present, past = fan_out(
+        lambda conn: conn.execute(queries.get("customer_info"), {"customer_id": customer_id}).mappings().first(), #current customer's information
+        lambda conn: conn.execute(queries.get("customer_present"), {"customer_id": customer_id}).mappings().all(), #present rentals of current customer
+        lambda conn: conn.execute(past_sql, history_params).mappings().all() #past rentals of current customer
+    )
+    more = len(past) > history_size
+    past = past[:history_size]
     data = dict(info) #getting the rows and putting them into a dictionary
-    data["current_rentals"] = [dict(r) for r in present] #adding the current rentals to the dictionary
-    data["rental_history"] = [dict(r) for r in past] #adding the past rentals to the dictionary as well
-    return jsonify(data) #converting the data found into JSON format
+    data["current_rentals"] = list_items(present, queries.get("customer_present")) #adding the current rentals to the dictionary
+    data["rental_history"] = list_items(past, past_sql) #adding the past rentals to the dictionary as well
+    data["historyNextCursor"] = encode_cursor([past[-1]["rental_date"].isoformat(), past[-1]["rental_id"]], {"customer_id": customer_id}) if more else None #older rentals, pass back as historyCursor
+    return respond(data) #converting the data found into JSON format
+
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "1000")) #rows fetched from the server side cursor and written per chunk
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"} #export format -> content type
+
+def stream_export(sql, params, name): #streams a query as NDJSON or CSV, reading it through a server side cursor so memory stays flat
+    fmt = request.args.get("format", "ndjson", type = str).strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"ok": False, "error": "format must be ndjson or csv."}), 400
+    engine = db.engine #read here, the generator runs after the view returns
+
+    def generate(): #yields one chunk of text per EXPORT_CHUNK rows
+        with engine.connect() as conn: #connecting to the db, stays open until the last chunk is sent
+            result = conn.execution_options(stream_results = True, yield_per = EXPORT_CHUNK).execute(sql, params)
+            columns = list(result.keys())
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                for rows in result.partitions():
+                    writer.writerows(rows)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                if buffer.tell():
+                    yield buffer.getvalue() #header only, the result was empty
+            else:
+                for rows in result.partitions():
+                    yield "".join(app.json.dumps(dict(zip(columns, row))) + "\n" for row in rows) #same dates and decimals as the JSON endpoints
+
+    return Response(stream_with_context(generate()), mimetype = EXPORT_FORMATS[fmt], headers = {"Content-Disposition": f"attachment; filename={name}.{fmt}"})
+
+#As a user I want to download every customer with their rental numbers
+@app.get("/api/export/customers") #?format=ndjson or csv
+@admission.limit("heavy")
+def export_customers(): #function for streaming every customer
+    sql = queries.get("export_customers", app.config["RENTAL_STATS"]) #rental numbers from the rollup or from the rental table
+    return stream_export(sql, {}, "customers")
+
+#As a user I want to download a customer's full rental history
+@app.get("/api/export/customers/<int:customer_id>/rentals") #?format=ndjson or csv
+@admission.limit("heavy")
+def export_customer_rentals(customer_id): #function for streaming every rental of one customer, newest first
+    sql = queries.get("export_customer_rentals")
+    return stream_export(sql, {"customer_id": customer_id}, f"customer_{customer_id}_rentals")
+
+#As a user I want to download the whole rental ledger
+@app.get("/api/export/rentals") #?format=ndjson or csv
+@admission.limit("heavy")
+def export_rentals(): #function for streaming every rental
+    sql = queries.get("export_rentals")
+    return stream_export(sql, {}, "rentals")
+
+RENTAL_BATCH_LIMIT = 100 #most films one checkout can rent at once
+
+def customer_rental_error(active): #rules a customer has to pass before renting, returns (message, status) or None
+    if active is None:
+        return "Customer not found.", 404 #no matching customer ID
+    if not active:
+        return "Customer is inactive.", 400 #customer is not active
+    return None
+
+def rental_transaction(): #the transaction a rental runs in, READ COMMITTED on MySQL so the allocator's copy check sees rentals committed while it waited for the row lock
+    if db.engine.dialect.name == "mysql":
+        return db.engine.execution_options(isolation_level = "READ COMMITTED").begin() #the connection goes back to the pool's default level afterwards
+    return db.engine.begin()
 
 #As a user I want to be able to rent a film out to a customer
 @app.post("/api/rentals")
+@admission.limit("write")
 def rent_film(): #function for renting a film out to a customer
     data = request.get_json() or {} #reading the incoming request as JSON, need to include empty JSON as other option to prevent crashes
     customer_id = data.get("customer_id") #getting customer ID from user input, the customer that wants to rent the film
@@ -339,44 +623,136 @@ def rent_film(): #function for renting a film out to a customer
 
     if not customer_id or not film_id:
         return jsonify({"ok": False, "error": "customer_id and film_id are required."}), 400 #added an edge case if either customer or film ID are not found
+    try:
+        customer_id, film_id = int(customer_id), int(film_id) #checked before the transaction, same as the batch checkout
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "customer_id and film_id must be numbers."}), 400
+
+    inventory = None #the copy being rented, set once one is found
+    try:
+        with rental_transaction() as conn: #connecting to the db, .begin() this time since it is a transactional SQL query
+
+            #finding the customer, added an edge case if the customer is not active or not existent
+            customer = conn.execute(queries.get("customer_active"), {"customer_id": customer_id}).scalar()
+            error = customer_rental_error(customer)
+            if error:
+                return jsonify({"ok": False, "error": error[0]}), error[1]
+
+            #finding an available copy of the current film, meaning it has no active rental
+            if app.config["INVENTORY_ALLOCATOR"]:
+                inventory = allocator.acquire(conn, film_id, store_id) #takes a copy from memory and row locks it, no two requests get the same copy
+            else:
+                inventory = conn.execute(queries.get("free_copy"), {"film_id": film_id, "store_id": store_id}).scalar()
+
+            if inventory is None:
+                return jsonify({"ok": False, "error": "No available copies for this film"}), 400 #if no copies of that film are left
+
+            #if everything is valid, let the customer rent the film
+            conn.execute(queries.get("rental_insert"), {
+                "rental_date": datetime.utcnow(),
+                "inventory_id": inventory,
+                "customer_id": customer_id,
+                "staff_id": staff_id
+            })
+    except Exception:
+        if app.config["INVENTORY_ALLOCATOR"] and inventory is not None:
+            allocator.release(film_id, store_id, inventory) #the rental rolled back, so the copy goes back in the pool
+        raise
+
+    if app.config["INVENTORY_ALLOCATOR"]:
+        allocator.confirm(inventory) #the rental committed, the copy stays out of the pool
+    if app.config["LEADERBOARD"]:
+        leaderboard.record_rental(film_id) #the rental is committed, bump the film's counter
+    invalidate_rentals([(customer_id, film_id)]) #drops only the cached pages this rental changed
+    return jsonify({"ok": True, "message": f"Film {film_id} rented to customer {customer_id}."}) #successful rental
 
-    with db.engine.begin() as conn: #connecting to the db, .begin() this time since it is a transactional SQL query
-        
-        #finding the customer, added an edge case if the customer is not active or not existent
-        customer = conn.execute(text("SELECT active FROM customer WHERE customer_id = :customer_id"), {"customer_id": customer_id}).scalar()
-        if customer is None:
-            return jsonify({"ok": False, "error": "Customer not found."}), 404 #no matching customer ID
-        if not customer:
-            return jsonify({"ok": False, "error": "Customer is inactive."}), 400 #customer is not active
-
-        #finding an available copy of the current film, meaning it has no active rental
-        inventory = conn.execute(text("""
-            SELECT i.inventory_id
-            FROM inventory AS i
-            LEFT JOIN rental AS r
-            ON i.inventory_id = r.inventory_id
-            AND r.return_date IS NULL
-            WHERE i.film_id = :fid
-            AND i.store_id = :sid
-            AND r.rental_id IS NULL
-            LIMIT 1
-        """), {"fid": film_id, "sid": store_id}).scalar()
-
-        if inventory is None:
-            return jsonify({"ok": False, "error": "No available copies for this film"}), 400 #if no copies of that film are left
-
-        #if everything is valid, let the customer rent the film
-        conn.execute(text("""
-            INSERT INTO rental (rental_date, inventory_id, customer_id, staff_id)
-            VALUES (:rental_date, :inventory, :customer_id, :staff_id)
-        """), {
-            "rental_date": datetime.utcnow(),
-            "inventory": inventory,
-            "customer_id": customer_id,
-            "staff_id": staff_id
-        })
+#As a user I want to be able to rent several films to customers in one checkout
+@app.post("/api/rentals/batch")
+@admission.limit("write")
+def rent_films_batch(): #function for renting many films at once, same rules as rent_film but one transaction
+    data = request.get_json() or {} #reading the incoming request as JSON, need to include empty JSON as other option to prevent crashes
+    items = data.get("items") #list of {"customer_id", "film_id"} pairs
+    staff_id = 1  #need a staff member for SQL insert query
+    store_id = 1  #need a store ID for SQL insert query
 
-    return jsonify({"ok": True, "message": f"Film {film_id} rented to customer {customer_id}."}) #successful rental
+    if not isinstance(items, list) or not items:
+        return jsonify({"ok": False, "error": "items must be a non-empty list."}), 400
+    if len(items) > RENTAL_BATCH_LIMIT:
+        return jsonify({"ok": False, "error": f"At most {RENTAL_BATCH_LIMIT} items per batch."}), 400
+
+    results = [None] * len(items) #one result per item, in the same order
+    pending = [] #(index, customer_id, film_id) of items that passed the basic checks
+    for index, item in enumerate(items):
+        customer_id = item.get("customer_id") if isinstance(item, dict) else None
+        film_id = item.get("film_id") if isinstance(item, dict) else None
+        if not customer_id or not film_id:
+            results[index] = {"ok": False, "status": 400, "error": "customer_id and film_id are required."}
+            continue
+        try:
+            pending.append((index, int(customer_id), int(film_id)))
+        except (TypeError, ValueError):
+            results[index] = {"ok": False, "status": 400, "error": "customer_id and film_id must be numbers."}
+
+    rented = [] #(index, customer_id, film_id, inventory_id) of items that got a copy
+    try:
+        with rental_transaction() as conn: #connecting to the db, one transaction for the whole checkout
+            if pending:
+                #every customer in one query
+                customers = dict(conn.execute(queries.get("customers_active"), {"ids": sorted({customer_id for _, customer_id, _ in pending})}).all())
+
+                #free copies for every film in one query, the allocator loads its pools for every film in one query instead
+                free = {}
+                if app.config["INVENTORY_ALLOCATOR"]:
+                    allocator.ensure(conn, sorted({film_id for _, _, film_id in pending}), store_id) #acquire below then finds every pool loaded
+                else:
+                    for film_id, inventory_id in conn.execute(queries.get("free_copies"), {"film_ids": sorted({film_id for _, _, film_id in pending}), "store_id": store_id}):
+                        free.setdefault(film_id, []).append(inventory_id)
+
+                for index, customer_id, film_id in pending:
+                    error = customer_rental_error(customers.get(customer_id))
+                    if error:
+                        results[index] = {"ok": False, "status": error[1], "error": error[0]}
+                        continue
+                    if app.config["INVENTORY_ALLOCATOR"]:
+                        inventory = allocator.acquire(conn, film_id, store_id) #same locked allocation rent_film uses
+                    else:
+                        copies = free.get(film_id)
+                        inventory = copies.pop() if copies else None #each copy goes to one item only
+                    if inventory is None:
+                        results[index] = {"ok": False, "status": 400, "error": "No available copies for this film"}
+                        continue
+                    rented.append((index, customer_id, film_id, inventory))
+
+            if rented:
+                rental_date = datetime.utcnow()
+                conn.execute(queries.get("rental_insert"), [ #executemany, one round trip for every insert
+                    {"rental_date": rental_date, "inventory_id": inventory, "customer_id": customer_id, "staff_id": staff_id}
+                    for _, customer_id, _, inventory in rented
+                ])
+    except Exception:
+        if app.config["INVENTORY_ALLOCATOR"]:
+            for _, _, film_id, inventory in rented:
+                allocator.release(film_id, store_id, inventory) #the checkout rolled back, so the copies go back in the pool
+        raise
+
+    for index, customer_id, film_id, inventory in rented:
+        if app.config["INVENTORY_ALLOCATOR"]:
+            allocator.confirm(inventory) #the rental committed, the copy stays out of the pool
+        if app.config["LEADERBOARD"]:
+            leaderboard.record_rental(film_id) #the rental is committed, bump the film's counter
+        results[index] = {"ok": True, "status": 200, "message": f"Film {film_id} rented to customer {customer_id}."}
+    if rented:
+        invalidate_rentals([(customer_id, film_id) for _, customer_id, film_id, _ in rented]) #drops only the cached pages these rentals changed
+
+    return jsonify({"ok": all(r["ok"] for r in results), "results": results}) #per item results, the request itself succeeded
 
 if __name__ == "__main__":
+    with app.app_context():
+        queries.warm() #reflecting the tables and building every query and filter combination before the first request
+    if app.config["SEARCH_INDEX"]:
+        with app.app_context(), db.engine.connect() as conn:
+            search_index.build(conn) #building the search index at startup so the first search does not pay for it
+    if app.config["LEADERBOARD"]:
+        with app.app_context(), db.engine.connect() as conn:
+            leaderboard.build(conn) #counting rentals once at startup instead of on every homepage hit
     app.run(host="127.0.0.1", port=5000, debug=True) #running and restarting the server if changes are made on port 127.0.0.1
\ No newline at end of file
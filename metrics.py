@@ -0,0 +1,198 @@
+from flask import request, g #for timing each request
+from sqlalchemy import event #for timing each statement
+from bisect import bisect_left #for finding a histogram bucket
+import hashlib, logging, re, threading, time #labelling statements, logging slow queries, cleaning statements, sharing between threads and timing
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) #upper bounds in seconds
+ROW_BUCKETS = (1, 5, 10, 20, 50, 100, 500, 1000, 5000, 10000) #upper bounds in rows
+MAX_STATEMENTS = 500 #most distinct statements tracked, the rest are counted as "other"
+QUANTILES = (0.5, 0.95, 0.99)
+
+slow_log = logging.getLogger("slow_query") #statements slower than the threshold are logged here
+
+class Histogram: #cumulative bucket counts plus sum and count, the same shape Prometheus uses
+    def __init__(self, buckets = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) #the last slot is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value): #caller holds the metrics lock
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q): #estimates a quantile from the buckets, interpolating inside the bucket it falls in
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+def clean_statement(statement): #turns a SQL statement into a short label, IN lists of any length look the same
+    statement = re.sub(r"--[^\n]*", "", statement) #comments
+    statement = re.sub(r"(\?|%s|%\(\w+\)s|:\w+)(\s*,\s*(\?|%s|%\(\w+\)s|:\w+))+", r"\1, ...", statement) #expanded IN lists
+    statement = re.sub(r"%\((\w+?)_\d+\)s", r"%(\1)s", statement) #numbered IN parameters
+    statement = " ".join(statement.split())
+    if len(statement) <= 160:
+        return statement
+    return f"{statement[:160]}... #{hashlib.sha1(statement.encode()).hexdigest()[:8]}" #long statements that start the same still get their own label
+
+def redact(parameters): #parameter types instead of values, searches carry customer names and emails
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+def escape(value): #label values in the Prometheus text format
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class Metrics: #request and statement timings, pool usage and a slow query log, exported in Prometheus text format
+    def __init__(self, slow_ms = 200, explain = False, log_parameters = False):
+        self.slow_seconds = slow_ms / 1000 #statements slower than this are logged
+        self.explain = explain #also run EXPLAIN for slow SELECTs
+        self.log_parameters = log_parameters #log the real parameter values instead of their types, only for debugging on a local copy of the data
+        self.lock = threading.Lock()
+        self.routes = {} #(method, route, status) -> Histogram of seconds
+        self.statements = {} #statement label -> Histogram of seconds
+        self.statement_rows = {} #statement label -> Histogram of rows returned
+        self.route_db_seconds = {} #route -> total seconds its statements spent in the db
+        self.checkout_wait = Histogram() #seconds spent waiting for a pooled connection
+        self.local = threading.local() #route of the request a thread is working for, fan-out threads get it from the request thread
+        self.slow_count = 0 #statements slower than the threshold so far
+        self.collectors = [] #functions returning extra metric lines, for other parts of the app
+        self.engine = None
+
+    def instrument(self, app, engine): #hooks the request and engine events, call once at startup inside an app context
+        self.engine = engine
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+        event.listen(engine, "after_cursor_execute", self.after_execute)
+        raw_connection = engine.raw_connection
+        def timed_raw_connection(*args, **kwargs): #every Connection checks out its DBAPI connection through here
+            started = time.perf_counter()
+            try:
+                return raw_connection(*args, **kwargs)
+            finally:
+                waited = time.perf_counter() - started
+                with self.lock:
+                    self.checkout_wait.observe(waited)
+        engine.raw_connection = timed_raw_connection
+
+    def start_request(self):
+        g.metrics_started = time.perf_counter()
+        self.local.route = request.url_rule.rule if request.url_rule else "unmatched"
+
+    def end_request(self, response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            key = (request.method, request.url_rule.rule if request.url_rule else "unmatched", response.status_code)
+            elapsed = time.perf_counter() - started #streamed exports are timed until the first chunk is handed to the server
+            with self.lock:
+                self.routes.setdefault(key, Histogram()).observe(elapsed)
+        self.local.route = None
+        return response
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_started"] = time.perf_counter() #a connection runs one statement at a time
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        label = clean_statement(statement)
+        route = getattr(self.local, "route", None)
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 and not executemany else None #-1 when the driver does not know
+        with self.lock:
+            if label not in self.statements and len(self.statements) >= MAX_STATEMENTS:
+                label = "other"
+            self.statements.setdefault(label, Histogram()).observe(elapsed)
+            if route is not None:
+                self.route_db_seconds[route] = self.route_db_seconds.get(route, 0) + elapsed
+            if rows is not None:
+                self.statement_rows.setdefault(label, Histogram(ROW_BUCKETS)).observe(rows)
+        if elapsed >= self.slow_seconds:
+            self.log_slow(conn, cursor, statement, parameters, context, elapsed, route)
+
+    def log_slow(self, conn, cursor, statement, parameters, context, elapsed, route): #logs a slow statement with its parameter types and, if asked, its plan
+        plan = None
+        streaming = context is not None and context.execution_options.get("stream_results")
+        if self.explain and not streaming and statement.lstrip().upper().startswith("SELECT"): #a streaming cursor still owns the connection
+            prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+            try:
+                explain_cursor = cursor.connection.cursor()
+                explain_cursor.execute(prefix + statement, parameters)
+                plan = [list(row) for row in explain_cursor.fetchall()]
+                explain_cursor.close()
+            except Exception as error: #the plan is a bonus, never fail the real query over it
+                plan = f"EXPLAIN failed: {error}"
+        with self.lock:
+            self.slow_count += 1
+        shown = repr(parameters)[:1000] if self.log_parameters else redact(parameters)
+        slow_log.warning("slow query %.3fs on %s: %s params=%s%s", elapsed, route, " ".join(statement.split()), shown, f" plan={plan}" if plan is not None else "")
+
+    def pool_lines(self): #pool size, checked out connections and saturation
+        pool = self.engine.pool if self.engine is not None else None
+        if pool is None or not hasattr(pool, "checkedout"):
+            return []
+        checked_out = pool.checkedout()
+        capacity = pool.size() + max(getattr(pool, "_max_overflow", 0), 0) if hasattr(pool, "size") else 0
+        lines = [
+            "# HELP app_db_pool_checked_out Connections currently checked out of the pool.",
+            "# TYPE app_db_pool_checked_out gauge",
+            f"app_db_pool_checked_out {checked_out}",
+            "# HELP app_db_pool_capacity Pool size plus allowed overflow.",
+            "# TYPE app_db_pool_capacity gauge",
+            f"app_db_pool_capacity {capacity}",
+        ]
+        if capacity:
+            lines += [
+                "# HELP app_db_pool_saturation Checked out connections divided by capacity.",
+                "# TYPE app_db_pool_saturation gauge",
+                f"app_db_pool_saturation {checked_out / capacity:.4f}",
+            ]
+        return lines
+
+    def histogram_lines(self, name, help_text, histograms, label_names): #one Prometheus histogram family plus estimated quantiles
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        quantile_lines = [f"# HELP {name}_quantile Quantiles estimated from {name} buckets.", f"# TYPE {name}_quantile gauge"]
+        for key, histogram in sorted(histograms.items(), key = lambda item: str(item[0])):
+            values = key if isinstance(key, tuple) else (key,)
+            labels = ",".join(f'{label}="{escape(value)}"' for label, value in zip(label_names, values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+            for q in QUANTILES:
+                quantile_lines.append(f'{name}_quantile{{{prefix}quantile="{q}"}} {histogram.quantile(q):.6f}')
+        return lines + quantile_lines
+
+    def render(self): #everything in Prometheus text format
+        with self.lock:
+            lines = self.histogram_lines("app_request_duration_seconds", "Time spent serving each route.", self.routes, ("method", "route", "status"))
+            lines += self.histogram_lines("app_db_statement_duration_seconds", "Time spent executing each SQL statement.", self.statements, ("statement",))
+            lines += self.histogram_lines("app_db_statement_rows", "Rows returned by each SQL statement, when the driver reports it.", self.statement_rows, ("statement",))
+            lines += ["# HELP app_db_route_seconds_total Time statements spent in the db, per route.", "# TYPE app_db_route_seconds_total counter"]
+            lines += [f'app_db_route_seconds_total{{route="{escape(route)}"}} {seconds:.6f}' for route, seconds in sorted(self.route_db_seconds.items())]
+            lines += self.histogram_lines("app_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", {(): self.checkout_wait}, ())
+            lines += [
+                "# HELP app_slow_queries_total Statements slower than the slow query threshold.",
+                "# TYPE app_slow_queries_total counter",
+                f"app_slow_queries_total {self.slow_count}",
+            ]
+        lines += self.pool_lines()
+        for collector in self.collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,82 @@
+from flask import current_app, request, Response #for building and compressing responses inside a view
+from datetime import date #rental dates, written as ISO 8601
+from decimal import Decimal #prices and payment totals, written as strings so no cents are lost
+import gzip, json #gzip is always there, json is the fallback encoder
+
+try:
+    import orjson #optional, much faster than the json module and writes datetimes itself
+except ImportError:
+    orjson = None
+
+try:
+    import brotli #optional, smaller than gzip for JSON at a similar speed when the quality is kept low
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ("application/json", "text/plain", "text/html", "text/csv", "application/x-ndjson") #mimetypes worth compressing
+
+def default(value): #types the encoders do not know, orjson only calls this for Decimal
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date): #datetime is a date too
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def dumps(data): #compact JSON bytes, keys are kept in the order they were added
+    if orjson is not None:
+        return orjson.dumps(data, default = default, option = orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default = default, separators = (",", ":")).encode()
+
+def columnar(rows, columns): #column names once and one array of values per row, instead of repeating every key on every row
+    return {"columns": list(columns), "rows": [tuple(r.values()) for r in rows]}
+
+def column(items, name): #the values of one column in either row format
+    if isinstance(items, dict):
+        index = items["columns"].index(name)
+        return [row[index] for row in items["rows"]]
+    return [r[name] for r in items]
+
+def response(data, status = 200): #a JSON response through dumps instead of jsonify
+    return Response(dumps(data), status = status, mimetype = "application/json")
+
+class Compression: #gzip or brotli for responses above a size, picked from the client's Accept-Encoding
+    def __init__(self, min_bytes = 1024, gzip_level = 6, brotli_quality = 5):
+        self.min_bytes = min_bytes #smaller bodies fit in a packet or two anyway, compressing them costs more than it saves
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality #11 is the smallest but far too slow to run per request
+        self.codings = ("br", "gzip") if brotli is not None else ("gzip",) #preferred first when the client rates them the same
+
+    def install(self, app): #hooks the response, call once at startup
+        app.after_request(self.compress)
+
+    def choose(self): #the best coding the client accepts, or None
+        qualities = {coding: request.accept_encodings[coding] for coding in self.codings}
+        best = max(self.codings, key = lambda coding: qualities[coding]) #max keeps the first of equal qualities
+        return best if qualities[best] > 0 else None
+
+    def compress(self, response):
+        if not current_app.config.get("COMPRESSION") or response.mimetype not in COMPRESSIBLE:
+            return response
+        if response.status_code == 304: #no body, but the headers have to match the 200 being revalidated
+            response.vary.add("Accept-Encoding")
+            etag, weak = response.get_etag()
+            if etag and not weak and request.if_none_match.is_weak(etag):
+                response.set_etag(etag, weak = True) #the client holds the compressed copy, which was sent with a weak etag
+            return response
+        if response.is_streamed or response.direct_passthrough or "Content-Encoding" in response.headers or response.status_code < 200 or response.status_code == 204:
+            return response #exports stream and bodies compressed elsewhere are left alone
+        response.vary.add("Accept-Encoding") #shared caches keep one copy per coding
+        coding = self.choose()
+        if coding is None or response.content_length is None or response.content_length < self.min_bytes:
+            return response
+        body = response.get_data()
+        if coding == "br":
+            body = brotli.compress(body, quality = self.brotli_quality)
+        else:
+            body = gzip.compress(body, compresslevel = self.gzip_level, mtime = 0) #mtime 0 so the same body always gives the same bytes
+        response.set_data(body)
+        response.headers["Content-Encoding"] = coding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak = True) #the bytes changed, but it is still the same content for If-None-Match
+        return response
@@ -0,0 +1,376 @@
+from sqlalchemy import MetaData, select, func, and_, or_, exists, distinct, case, null, bindparam, type_coerce, String, literal_column #for building queries
+from sql_functions import group_concat, add_days, days_between #functions MySQL and SQLite spell differently
+from rental_stats import customer_rental_stats #per-customer rental numbers, used when RENTAL_STATS is on
+from itertools import product #for building every filter combination up front
+import threading #queries are shared by every request thread
+
+SAKILA_TABLES = ("film", "actor", "film_actor", "category", "film_category", "language", "inventory", "rental", "customer", "address", "city", "country")
+
+#every query and the number of on/off options it takes, so warm() can build each combination before the first request
+QUERIES = {
+    "top5_films": 0, "top5_actors": 0,
+    "film_details": 1, #allocator on
+    "film_actors": 0, "actor_info": 0, "actor_top_films": 0,
+    "films_batch": 0, "film_counts_batch": 0, "film_actors_batch": 0, "actors_batch": 0, "actor_films_batch": 0, "film_actor_ids": 0,
+    "films_search": 4, #title, actor, genre, cursor seek
+    "films_by_ids": 0,
+    "films_search_count": 3, #title, actor, genre
+    "customers_count": 0,
+    "customers_page": 1, #rental stats on
+    "customers_search": 5, #first name, last name, customer id, cursor seek, rental stats on
+    "customers_search_count": 3, #first name, last name, customer id
+    "customer_info": 0, "customer_present": 0,
+    "customer_history": 1, #history cursor
+    "export_customers": 1, #rental stats on
+    "export_customer_rentals": 0, "export_rentals": 0,
+    "customer_active": 0, "customers_active": 0, "free_copies": 0, "free_copy": 0, "lock_copy": 0, "rental_insert": 0,
+}
+
+def ids_param(name): #a list of ids that expands to one placeholder each
+    return bindparam(name, expanding = True)
+
+class Queries: #every route query as a SQLAlchemy Core statement over the reflected Sakila tables, built once per filter combination and reused
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engine = None
+        self.tables = None #table name -> Table, reflected on first use
+        self.statements = {} #(name, options...) -> statement
+
+    def bind(self, engine): #the engine tables are reflected from, nothing is read until the first query
+        self.engine = engine
+
+    def reflect(self):
+        with self.lock:
+            if self.tables is None:
+                metadata = MetaData()
+                metadata.reflect(bind = self.engine, only = SAKILA_TABLES)
+                self.tables = {name: metadata.tables[name] for name in SAKILA_TABLES}
+
+    def get(self, name, *options): #the statement for a query and its options, built the first time it is asked for
+        key = (name, *options)
+        statement = self.statements.get(key)
+        if statement is None:
+            if self.tables is None:
+                self.reflect()
+            statement = getattr(self, name)(*options)
+            with self.lock:
+                statement = self.statements.setdefault(key, statement) #another thread may have built it first
+        return statement
+
+    def warm(self): #builds every query and combination at startup so no request pays for it
+        for name, count in QUERIES.items():
+            for options in product((False, True), repeat = count):
+                self.get(name, *options)
+
+    def alias(self, name, short): #table alias, keeps the SQL readable in logs and EXPLAIN
+        return self.tables[name].alias(short)
+
+    #columns shared by several queries
+
+    def actor_name(self, a): #"first last", CONCAT on MySQL and || on SQLite
+        return (a.c.first_name + " " + a.c.last_name).label("name")
+
+    def film_columns(self, f, c, l): #film information shown on the film pages
+        return [
+            f.c.film_id.label("id"), f.c.title, f.c.description, f.c.release_year, group_concat(c.c.name).label("categories"),
+            l.c.name.label("language"), f.c.rental_duration, f.c.rental_rate, f.c.length.label("duration"), f.c.replacement_cost, f.c.rating,
+            type_coerce(f.c.special_features, String).label("special_features"), f.c.last_update #as the plain string, a reflected MySQL SET would come back as a python set
+        ]
+
+    def film_group_by(self, f, l):
+        return [f.c.film_id, f.c.title, f.c.description, f.c.release_year, l.c.name, f.c.rental_duration, f.c.rental_rate, f.c.length, f.c.replacement_cost, f.c.rating, f.c.special_features, f.c.last_update]
+
+    def film_joins(self, f, c, l): #film with its language and categories
+        fc = self.alias("film_category", "fc")
+        return f.join(l, l.c.language_id == f.c.language_id).outerjoin(fc, fc.c.film_id == f.c.film_id).outerjoin(c, c.c.category_id == fc.c.category_id)
+
+    def customer_columns(self, c, a, ci, co): #customer information shown in the customer listings
+        return [c.c.customer_id, c.c.store_id, c.c.first_name, c.c.last_name, c.c.email, c.c.active, a.c.address, a.c.address2, a.c.district, ci.c.city, co.c.country]
+
+    def customer_joins(self, c, a, ci, co): #customer with their address
+        return c.join(a, a.c.address_id == c.c.address_id).join(ci, ci.c.city_id == a.c.city_id).join(co, co.c.country_id == ci.c.country_id)
+
+    def customer_stats(self, c, from_, rental_stats): #total_rentals, current_rentals and last_rental_date from the rollup or from the rental table
+        if rental_stats: #customers with no rentals have no row so they fall back to 0
+            s = customer_rental_stats.alias("s")
+            columns = [func.coalesce(s.c.total_rentals, 0).label("total_rentals"), func.coalesce(s.c.current_rentals, 0).label("current_rentals"), s.c.last_rental_date]
+            return columns, from_.outerjoin(s, s.c.customer_id == c.c.customer_id)
+        r = self.alias("rental", "r")
+        columns = [ #the original correlated subqueries
+            select(func.count()).where(r.c.customer_id == c.c.customer_id).scalar_subquery().label("total_rentals"),
+            select(func.count()).where(r.c.customer_id == c.c.customer_id, r.c.return_date.is_(None)).scalar_subquery().label("current_rentals"),
+            select(func.max(r.c.rental_date)).where(r.c.customer_id == c.c.customer_id).scalar_subquery().label("last_rental_date"),
+        ]
+        return columns, from_
+
+    #home page
+
+    def top5_films(self):
+        f, i, r = self.alias("film", "f"), self.alias("inventory", "i"), self.alias("rental", "r")
+        rentals_count = func.count(r.c.rental_id).label("rentals_count")
+        return (select(f.c.film_id, f.c.title, rentals_count)
+            .select_from(f.join(i, i.c.film_id == f.c.film_id).join(r, r.c.inventory_id == i.c.inventory_id))
+            .group_by(f.c.film_id, f.c.title)
+            .order_by(rentals_count.desc())
+            .limit(5))
+
+    def top5_actors(self):
+        a, fa = self.alias("actor", "a"), self.alias("film_actor", "fa")
+        name = self.actor_name(a)
+        films_count = func.count(distinct(fa.c.film_id)).label("films_count")
+        return (select(a.c.actor_id, name, films_count)
+            .select_from(a.join(fa, fa.c.actor_id == a.c.actor_id))
+            .group_by(a.c.actor_id, name)
+            .order_by(films_count.desc(), name)
+            .limit(5))
+
+    #film and actor pages
+
+    def film_details(self, allocator): #free copies come from the allocator when it is on, otherwise they are counted with the rental table
+        f, c, l = self.alias("film", "f"), self.alias("category", "c"), self.alias("language", "l")
+        i, r, i2 = self.alias("inventory", "i"), self.alias("rental", "r"), self.alias("inventory", "i2")
+        total_copies = select(func.count()).select_from(i).where(i.c.film_id == f.c.film_id, i.c.store_id == bindparam("store_id")).scalar_subquery()
+        if allocator:
+            available_copies = null()
+        else:
+            available_copies = (select(func.count())
+                .select_from(i.outerjoin(r, and_(r.c.inventory_id == i.c.inventory_id, r.c.return_date.is_(None))))
+                .where(i.c.film_id == f.c.film_id, i.c.store_id == bindparam("store_id"), r.c.rental_id.is_(None))
+                .scalar_subquery())
+        rentals_count = select(func.count()).select_from(r.join(i2, i2.c.inventory_id == r.c.inventory_id)).where(i2.c.film_id == f.c.film_id).scalar_subquery()
+        return (select(*self.film_columns(f, c, l), total_copies.label("total_copies"), available_copies.label("available_copies"), rentals_count.label("rentals_count"))
+            .select_from(self.film_joins(f, c, l))
+            .where(f.c.film_id == bindparam("film_id"))
+            .group_by(*self.film_group_by(f, l)))
+
+    def film_actors(self): #actors involved when clicking on a film
+        a, fa = self.alias("actor", "a"), self.alias("film_actor", "fa")
+        name = self.actor_name(a)
+        return (select(a.c.actor_id, name)
+            .select_from(a.join(fa, fa.c.actor_id == a.c.actor_id))
+            .where(fa.c.film_id == bindparam("film_id"))
+            .order_by(name))
+
+    def actor_info(self):
+        a, fa = self.alias("actor", "a"), self.alias("film_actor", "fa")
+        name = self.actor_name(a)
+        return (select(a.c.actor_id, name, func.count(distinct(fa.c.film_id)).label("films_count"))
+            .select_from(a.outerjoin(fa, fa.c.actor_id == a.c.actor_id))
+            .where(a.c.actor_id == bindparam("actor_id"))
+            .group_by(a.c.actor_id, name))
+
+    def actor_top_films(self):
+        f, fa, i, r = self.alias("film", "f"), self.alias("film_actor", "fa"), self.alias("inventory", "i"), self.alias("rental", "r")
+        rentals_count = func.count(r.c.rental_id).label("rentals_count")
+        return (select(f.c.film_id, f.c.title, rentals_count)
+            .select_from(f.join(fa, fa.c.film_id == f.c.film_id).join(i, i.c.film_id == f.c.film_id).join(r, r.c.inventory_id == i.c.inventory_id))
+            .where(fa.c.actor_id == bindparam("actor_id"))
+            .group_by(f.c.film_id, f.c.title)
+            .order_by(rentals_count.desc())
+            .limit(5))
+
+    #batch detail endpoints
+
+    def films_batch(self): #film information for every film, same columns as film_details without the counts
+        f, c, l = self.alias("film", "f"), self.alias("category", "c"), self.alias("language", "l")
+        return (select(*self.film_columns(f, c, l))
+            .select_from(self.film_joins(f, c, l))
+            .where(f.c.film_id.in_(ids_param("film_ids")))
+            .group_by(*self.film_group_by(f, l)))
+
+    def film_counts_batch(self): #copies, free copies and rentals for every film in one pass over inventory and rental
+        i, r = self.alias("inventory", "i"), self.alias("rental", "r")
+        in_store = i.c.store_id == bindparam("store_id")
+        store_copies = func.count(distinct(case((in_store, i.c.inventory_id))))
+        rented_copies = func.count(distinct(case((and_(in_store, r.c.rental_id.isnot(None), r.c.return_date.is_(None)), i.c.inventory_id))))
+        return (select(i.c.film_id, store_copies.label("total_copies"), (store_copies - rented_copies).label("available_copies"), func.count(r.c.rental_id).label("rentals_count"))
+            .select_from(i.outerjoin(r, r.c.inventory_id == i.c.inventory_id))
+            .where(i.c.film_id.in_(ids_param("film_ids")))
+            .group_by(i.c.film_id))
+
+    def film_actors_batch(self): #actors of every film, grouped by film in python
+        a, fa = self.alias("actor", "a"), self.alias("film_actor", "fa")
+        name = self.actor_name(a)
+        return (select(fa.c.film_id, a.c.actor_id, name)
+            .select_from(a.join(fa, fa.c.actor_id == a.c.actor_id))
+            .where(fa.c.film_id.in_(ids_param("film_ids")))
+            .order_by(fa.c.film_id, name))
+
+    def actors_batch(self):
+        a, fa = self.alias("actor", "a"), self.alias("film_actor", "fa")
+        name = self.actor_name(a)
+        return (select(a.c.actor_id, name, func.count(distinct(fa.c.film_id)).label("films_count"))
+            .select_from(a.outerjoin(fa, fa.c.actor_id == a.c.actor_id))
+            .where(a.c.actor_id.in_(ids_param("actor_ids")))
+            .group_by(a.c.actor_id, name))
+
+    def actor_films_batch(self): #rental counts of every film of every actor, the top 5 per actor are picked in python
+        f, fa, i, r = self.alias("film", "f"), self.alias("film_actor", "fa"), self.alias("inventory", "i"), self.alias("rental", "r")
+        return (select(fa.c.actor_id, f.c.film_id, f.c.title, func.count(r.c.rental_id).label("rentals_count"))
+            .select_from(f.join(fa, fa.c.film_id == f.c.film_id).join(i, i.c.film_id == f.c.film_id).join(r, r.c.inventory_id == i.c.inventory_id))
+            .where(fa.c.actor_id.in_(ids_param("actor_ids")))
+            .group_by(fa.c.actor_id, f.c.film_id, f.c.title))
+
+    def film_actor_ids(self): #actors of some films, for dropping their cached pages
+        fa = self.alias("film_actor", "fa")
+        return select(fa.c.actor_id).distinct().where(fa.c.film_id.in_(ids_param("film_ids")))
+
+    #film search
+
+    def film_search_filters(self, f, title, actor, genre): #one condition per search field the user filled in
+        where = []
+        if title:
+            where.append(f.c.title.like(bindparam("title")))
+        if actor: #connecting actor to film_actor for searching
+            fa, a = self.alias("film_actor", "fa"), self.alias("actor", "a")
+            where.append(exists(select(literal_column("1")).select_from(fa.join(a, a.c.actor_id == fa.c.actor_id))
+                .where(fa.c.film_id == f.c.film_id, (a.c.first_name + " " + a.c.last_name).like(bindparam("actor")))))
+        if genre: #searching if a film matches the genre
+            fc, c = self.alias("film_category", "fc"), self.alias("category", "c")
+            where.append(exists(select(literal_column("1")).select_from(fc.join(c, c.c.category_id == fc.c.category_id))
+                .where(fc.c.film_id == f.c.film_id, c.c.name.like(bindparam("genre")))))
+        return where
+
+    def film_search_rows(self, where): #one page of search results, uses offset or the cursor to show different pages of films
+        f, fc, c = self.alias("film", "f"), self.alias("film_category", "fc"), self.alias("category", "c")
+        return (select(f.c.film_id, f.c.title, f.c.release_year, f.c.rating, f.c.length, group_concat(c.c.name).label("categories"))
+            .select_from(f.outerjoin(fc, fc.c.film_id == f.c.film_id).outerjoin(c, c.c.category_id == fc.c.category_id))
+            .where(*where(f))
+            .group_by(f.c.film_id, f.c.title, f.c.release_year, f.c.rating, f.c.length)
+            .order_by(f.c.film_id)
+            .limit(bindparam("limit")).offset(bindparam("offset")))
+
+    def films_search(self, title, actor, genre, seek):
+        def where(f):
+            conditions = self.film_search_filters(f, title, actor, genre)
+            if seek:
+                conditions.append(f.c.film_id > bindparam("last_id")) #seeking past the last film instead of skipping rows with offset
+            return conditions
+        return self.film_search_rows(where)
+
+    def films_by_ids(self): #search results the search index already picked, SQL only loads the rows for this page
+        return self.film_search_rows(lambda f: [f.c.film_id.in_(ids_param("ids"))])
+
+    def films_search_count(self, title, actor, genre): #amount of rows returned from search
+        f = self.alias("film", "f")
+        return select(func.count()).select_from(f).where(*self.film_search_filters(f, title, actor, genre))
+
+    #customer pages
+
+    def customers_count(self):
+        return select(func.count()).select_from(self.tables["customer"])
+
+    def customers_page(self, rental_stats):
+        return self.customers_search(False, False, False, False, rental_stats)
+
+    def customer_search_filters(self, c, first_name, last_name, customer_id):
+        where = []
+        if first_name:
+            where.append(c.c.first_name.like(bindparam("first")))
+        if last_name:
+            where.append(c.c.last_name.like(bindparam("last")))
+        if customer_id: #no partial matching since this is an id
+            where.append(c.c.customer_id == bindparam("customer_id"))
+        return where
+
+    def customers_search(self, first_name, last_name, customer_id, seek, rental_stats): #uses offset or the cursor to show different pages of customers
+        c, a, ci, co = self.alias("customer", "c"), self.alias("address", "a"), self.alias("city", "ci"), self.alias("country", "co")
+        stats_columns, from_ = self.customer_stats(c, self.customer_joins(c, a, ci, co), rental_stats)
+        where = self.customer_search_filters(c, first_name, last_name, customer_id)
+        if seek:
+            where.append(c.c.customer_id > bindparam("last_id")) #seeking past the last customer instead of skipping rows with offset
+        return (select(*self.customer_columns(c, a, ci, co), *stats_columns)
+            .select_from(from_)
+            .where(*where)
+            .order_by(c.c.customer_id)
+            .limit(bindparam("limit")).offset(bindparam("offset")))
+
+    def customers_search_count(self, first_name, last_name, customer_id):
+        c = self.alias("customer", "c")
+        return select(func.count()).select_from(c).where(*self.customer_search_filters(c, first_name, last_name, customer_id))
+
+    def customer_info(self):
+        c, a, ci, co = self.alias("customer", "c"), self.alias("address", "a"), self.alias("city", "ci"), self.alias("country", "co")
+        return (select(*self.customer_columns(c, a, ci, co), c.c.create_date)
+            .select_from(self.customer_joins(c, a, ci, co))
+            .where(c.c.customer_id == bindparam("customer_id")))
+
+    def customer_rentals_from(self): #rentals with their film
+        r, i, f = self.alias("rental", "r"), self.alias("inventory", "i"), self.alias("film", "f")
+        return r, f, r.join(i, i.c.inventory_id == r.c.inventory_id).join(f, f.c.film_id == i.c.film_id)
+
+    def customer_present(self): #present rentals of a customer
+        r, f, from_ = self.customer_rentals_from()
+        return (select(r.c.rental_id, r.c.inventory_id, r.c.rental_date, f.c.film_id, f.c.title, f.c.rental_duration, add_days(r.c.rental_date, f.c.rental_duration).label("due_date"))
+            .select_from(from_)
+            .where(r.c.customer_id == bindparam("customer_id"), r.c.return_date.is_(None))
+            .order_by(r.c.rental_date.desc()))
+
+    def customer_history(self, before): #past rentals of a customer, newest first, before seeks past the last rental shown
+        r, f, from_ = self.customer_rentals_from()
+        where = [r.c.customer_id == bindparam("customer_id"), r.c.return_date.isnot(None)]
+        if before:
+            before_date = bindparam("before_date", type_ = r.c.rental_date.type) #a datetime, formatted the same way the dialect stores rental_date so equal dates compare equal
+            where.append(or_(r.c.rental_date < before_date, and_(r.c.rental_date == before_date, r.c.rental_id < bindparam("before_id"))))
+        return (select(r.c.rental_id, r.c.inventory_id, r.c.rental_date, r.c.return_date, f.c.film_id, f.c.title, days_between(r.c.rental_date, r.c.return_date).label("days_out"))
+            .select_from(from_)
+            .where(*where)
+            .order_by(r.c.rental_date.desc(), r.c.rental_id.desc())
+            .limit(bindparam("limit")))
+
+    #exports
+
+    def export_customers(self, rental_stats):
+        c, a, ci, co = self.alias("customer", "c"), self.alias("address", "a"), self.alias("city", "ci"), self.alias("country", "co")
+        stats_columns, from_ = self.customer_stats(c, self.customer_joins(c, a, ci, co), rental_stats)
+        return select(*self.customer_columns(c, a, ci, co), c.c.create_date, *stats_columns).select_from(from_).order_by(c.c.customer_id)
+
+    def export_customer_rentals(self):
+        r, f, from_ = self.customer_rentals_from()
+        return (select(r.c.rental_id, r.c.inventory_id, r.c.rental_date, r.c.return_date, f.c.film_id, f.c.title)
+            .select_from(from_)
+            .where(r.c.customer_id == bindparam("customer_id"))
+            .order_by(r.c.rental_date.desc(), r.c.rental_id.desc()))
+
+    def export_rentals(self):
+        r, i = self.alias("rental", "r"), self.alias("inventory", "i")
+        return (select(r.c.rental_id, r.c.rental_date, r.c.inventory_id, i.c.film_id, i.c.store_id, r.c.customer_id, r.c.staff_id, r.c.return_date)
+            .select_from(r.join(i, i.c.inventory_id == r.c.inventory_id))
+            .order_by(r.c.rental_id))
+
+    #rentals
+
+    def customer_active(self):
+        c = self.tables["customer"]
+        return select(c.c.active).where(c.c.customer_id == bindparam("customer_id"))
+
+    def customers_active(self):
+        c = self.tables["customer"]
+        return select(c.c.customer_id, c.c.active).where(c.c.customer_id.in_(ids_param("ids")))
+
+    def free_copies(self): #copies of a film in a store with no open rental
+        i, r = self.alias("inventory", "i"), self.alias("rental", "r")
+        return (select(i.c.film_id, i.c.inventory_id)
+            .select_from(i.outerjoin(r, and_(r.c.inventory_id == i.c.inventory_id, r.c.return_date.is_(None))))
+            .where(i.c.film_id.in_(ids_param("film_ids")), i.c.store_id == bindparam("store_id"), r.c.rental_id.is_(None))
+            .order_by(i.c.inventory_id))
+
+    def free_copy(self): #one copy of a film in a store with no open rental
+        i, r = self.alias("inventory", "i"), self.alias("rental", "r")
+        return (select(i.c.inventory_id)
+            .select_from(i.outerjoin(r, and_(r.c.inventory_id == i.c.inventory_id, r.c.return_date.is_(None))))
+            .where(i.c.film_id == bindparam("film_id"), i.c.store_id == bindparam("store_id"), r.c.rental_id.is_(None))
+            .limit(1))
+
+    def lock_copy(self): #locks the copy so no other transaction can rent it until we commit, and only returns it if it has no open rental
+        #only the inventory row is locked, a locking read on rental would take a gap lock and two new copies in the same gap deadlock on their inserts
+        #the rental check is a plain read, rent transactions run at READ COMMITTED on MySQL so it sees rentals committed while we waited for the lock
+        #SQLite has no FOR UPDATE and locks the whole db on write instead
+        i, r = self.tables["inventory"], self.tables["rental"]
+        return (select(i.c.inventory_id)
+            .where(i.c.inventory_id == bindparam("inventory_id"), i.c.film_id == bindparam("film_id"), i.c.store_id == bindparam("store_id"),
+                ~exists().where(r.c.inventory_id == i.c.inventory_id, r.c.return_date.is_(None)))
+            .with_for_update())
+
+    def rental_insert(self):
+        return self.tables["rental"].insert()
@@ -0,0 +1,61 @@
+from sqlalchemy import MetaData, Table, Column, Integer, DateTime, text #allows for SQL queries
+
+#summary table with one row per customer that has rented, replaces three rental scans per listed customer
+#declared here instead of reflected since this app creates it
+#triggers on rental keep it in step with every insert, return and delete, whether RENTAL_STATS is on or not and whoever writes the rental
+metadata = MetaData()
+customer_rental_stats = Table(
+    "customer_rental_stats", metadata,
+    Column("customer_id", Integer, primary_key = True, autoincrement = False),
+    Column("total_rentals", Integer, nullable = False, server_default = "0"),
+    Column("current_rentals", Integer, nullable = False, server_default = "0"),
+    Column("last_rental_date", DateTime, nullable = True),
+)
+
+#upsert syntax and the scalar max, the only parts of the triggers MySQL and SQLite spell differently
+UPSERT = {"mysql": ("ON DUPLICATE KEY UPDATE", "GREATEST"), "sqlite": ("ON CONFLICT (customer_id) DO UPDATE SET", "max")}
+
+def add_rental_sql(dialect_name): #adds the NEW rental to its customer's row, creating the row on their first rental
+    conflict, greatest = UPSERT[dialect_name]
+    return f"""
+        INSERT INTO customer_rental_stats (customer_id, total_rentals, current_rentals, last_rental_date)
+        VALUES (NEW.customer_id, 1, NEW.return_date IS NULL, NEW.rental_date)
+        {conflict}
+            total_rentals = total_rentals + 1,
+            current_rentals = current_rentals + (NEW.return_date IS NULL),
+            last_rental_date = {greatest}(COALESCE(last_rental_date, NEW.rental_date), NEW.rental_date)
+    """
+
+#takes the OLD rental off its customer's row, the latest date only has to be looked up again when OLD was the latest
+REMOVE_RENTAL_SQL = """
+    UPDATE customer_rental_stats
+    SET total_rentals = total_rentals - 1,
+        current_rentals = current_rentals - (OLD.return_date IS NULL),
+        last_rental_date = CASE WHEN OLD.rental_date < last_rental_date THEN last_rental_date
+            ELSE (SELECT MAX(r.rental_date) FROM rental AS r WHERE r.customer_id = OLD.customer_id) END
+    WHERE customer_id = OLD.customer_id
+"""
+
+def triggers(dialect_name): #trigger name -> (event, statements), an update is the old row taken off and the new row added, which covers returns
+    add = add_rental_sql(dialect_name)
+    return {
+        "rental_stats_insert": ("AFTER INSERT", [add]),
+        "rental_stats_update": ("AFTER UPDATE", [REMOVE_RENTAL_SQL, add]),
+        "rental_stats_delete": ("AFTER DELETE", [REMOVE_RENTAL_SQL]),
+    }
+
+def install_triggers(conn): #(re)creates the triggers, each change to rental then updates the rollup in the same transaction
+    for name, (event, statements) in triggers(conn.dialect.name).items():
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        conn.execute(text(f"CREATE TRIGGER {name} {event} ON rental FOR EACH ROW BEGIN {'; '.join(statements)}; END"))
+
+def rebuild(conn): #recomputes every customer's numbers from the rental table and installs the triggers that keep them right, run inside a transaction
+    customer_rental_stats.create(conn, checkfirst = True)
+    install_triggers(conn) #before the recount, so no rental can land between the two unseen
+    conn.execute(customer_rental_stats.delete())
+    conn.execute(text("""
+        INSERT INTO customer_rental_stats (customer_id, total_rentals, current_rentals, last_rental_date)
+        SELECT r.customer_id, COUNT(*), SUM(CASE WHEN r.return_date IS NULL THEN 1 ELSE 0 END), MAX(r.rental_date)
+        FROM rental AS r
+        GROUP BY r.customer_id
+    """))
@@ -0,0 +1,117 @@
+from flask import current_app, request, make_response, Response #for building cached responses inside a view
+from collections import OrderedDict #keeps entries in least recently used order
+from functools import wraps #keeps the view's name so flask routing still works
+import hashlib, threading, time #for etags, sharing between threads and expiry
+
+class ResponseCache: #bounded LRU of JSON responses with a TTL, strong ETags and tag based invalidation
+    def __init__(self, ttl = 60, max_entries = 2048, max_bytes = 32 * 1024 * 1024):
+        self.ttl = ttl #seconds an entry is served before the view runs again
+        self.max_entries = max_entries #most responses kept at once
+        self.max_bytes = max_bytes #most response bytes kept at once
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() #key -> (expires at, body, etag, tags), oldest use first
+        self.by_tag = {} #tag -> set of keys, so one write only drops the entries it touched
+        self.invalidated = OrderedDict() #tag -> monotonic time it was last invalidated, oldest first, stops a slow request from storing data older than a write
+        self.building = {} #start time -> number of responses being built that started then, older invalidations can be forgotten
+        self.size = 0 #bytes currently stored
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self): #counters for the cache stats endpoint
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def get(self, key): #returns (body, etag) for a fresh entry, or None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self.drop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key) #most recently used goes to the back
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, body, etag, tags, started): #stores a response unless one of its tags was invalidated while it was being built
+        with self.lock:
+            if any(self.invalidated.get(tag, 0) >= started for tag in tags):
+                return
+            if key in self.entries:
+                self.drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, body, etag, tags)
+            self.size += len(body)
+            for tag in tags:
+                self.by_tag.setdefault(tag, set()).add(key)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self.drop(next(iter(self.entries))) #least recently used first
+                self.evictions += 1
+
+    def drop(self, key): #removes one entry, caller holds the lock
+        _, body, _, tags = self.entries.pop(key)
+        self.size -= len(body)
+        for tag in tags:
+            keys = self.by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_tag[tag]
+
+    def begin(self): #marks a response as being built, returns its start time for put and end
+        with self.lock:
+            started = time.monotonic()
+            self.building[started] = self.building.get(started, 0) + 1
+            return started
+
+    def end(self, started): #the response is stored or thrown away
+        with self.lock:
+            self.building[started] -= 1
+            if not self.building[started]:
+                del self.building[started]
+
+    def invalidate(self, *tags): #drops every entry carrying any of the tags
+        now = time.monotonic()
+        with self.lock:
+            for tag in tags:
+                self.invalidated.pop(tag, None)
+                self.invalidated[tag] = now #re-inserting keeps the oldest invalidation at the front
+                for key in list(self.by_tag.get(tag, ())):
+                    self.drop(key)
+            oldest = min(self.building, default = now) #only responses started before an invalidation can be stopped by it
+            while self.invalidated and next(iter(self.invalidated.values())) < oldest:
+                self.invalidated.popitem(last = False)
+
+    def clear(self): #drops everything, counters included
+        with self.lock:
+            self.entries.clear()
+            self.by_tag.clear()
+            self.invalidated.clear() #responses still being built stay in building so they can finish
+            self.size = self.hits = self.misses = self.evictions = 0
+
+    def cached(self, tags = None): #decorator for GET views, tags(view kwargs, JSON data) returns the tags a write can invalidate the response by
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                if not current_app.config.get("RESPONSE_CACHE"):
+                    return view(**kwargs)
+                key = (request.path, tuple(sorted(request.args.items(multi = True)))) #route and arguments
+                hit = self.get(key)
+                if hit is None:
+                    started = self.begin()
+                    try:
+                        response = make_response(view(**kwargs))
+                        if response.status_code != 200 or not response.is_json:
+                            return response #errors and non JSON responses are never cached
+                        body = response.get_data()
+                        etag = hashlib.sha1(body).hexdigest()
+                        self.put(key, body, etag, frozenset(tags(kwargs, response.get_json()) if tags else ()), started)
+                    finally:
+                        self.end(started)
+                else:
+                    body, etag = hit
+                    response = Response(body, mimetype = "application/json")
+                response.set_etag(etag) #strong etag, the same bytes always give the same tag
+                return response.make_conditional(request) #turns into an empty 304 when the browser already has this etag
+            return wrapper
+        return decorator
@@ -0,0 +1,174 @@
+from sqlalchemy import text, bindparam #allows for SQL queries
+import threading, time #the index is shared by every request thread
+
+WILDCARDS = ("%", "_", "\\") #characters that mean something special inside LIKE, the index does not try to copy those rules
+
+def trigrams(value): #splits a lowercase string into every 3 character piece it contains
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+class TrigramField: #one searchable column, keeps the text for every key and which keys contain each trigram
+    def __init__(self):
+        self.texts = {} #key -> lowercase text
+        self.postings = {} #trigram -> set of keys whose text contains it
+
+    def put(self, key, value): #adds or replaces the text for a key
+        self.remove(key)
+        value = (value or "").casefold() #LIKE in MySQL is case insensitive with the default collation
+        self.texts[key] = value
+        for gram in trigrams(value):
+            self.postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key): #drops a key and its trigrams
+        old = self.texts.pop(key, None)
+        if old is None:
+            return
+        for gram in trigrams(old):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+    def match(self, query): #returns the keys whose text contains the query, same as LIKE '%query%'
+        query = query.casefold()
+        grams = trigrams(query)
+        if not grams: #queries shorter than 3 characters have no trigrams, so just check every text
+            return {key for key, value in self.texts.items() if query in value}
+        candidates = None
+        for gram in sorted(grams, key = lambda g: len(self.postings.get(g, ()))): #smallest posting list first keeps the intersection cheap
+            keys = self.postings.get(gram)
+            if not keys:
+                return set()
+            candidates = set(keys) if candidates is None else candidates & keys
+            if not candidates:
+                return set()
+        return {key for key in candidates if query in self.texts[key]} #trigrams can match out of order, so confirm the real substring
+
+class SearchIndex: #in-memory trigram index over film titles, actor names and category names
+    def __init__(self, refresh_interval = 30, rebuild_interval = 600):
+        self.refresh_interval = refresh_interval #seconds between last_update watermark checks
+        self.rebuild_interval = rebuild_interval #seconds between full rebuilds, picks up deleted rows the watermark cannot see
+        self.lock = threading.Lock() #guards the index structures, only held while reading or applying changes, never during queries
+        self.updating = threading.Lock() #one thread builds or refreshes at a time, the rest keep searching the current index
+        self.built_at = None #monotonic time of the last full build, None until the first build
+        self.checked_at = 0 #monotonic time of the last watermark check
+        self.watermarks = {} #table -> MAX(last_update) seen so far
+        self.titles = TrigramField() #film_id -> title
+        self.actors = TrigramField() #actor_id -> "first last"
+        self.categories = TrigramField() #category_id -> name
+        self.actor_films = {} #actor_id -> set of film_ids
+        self.film_actors = {} #film_id -> set of actor_ids
+        self.category_films = {} #category_id -> set of film_ids
+        self.film_categories = {} #film_id -> set of category_ids
+
+    def current_watermarks(self, conn): #newest last_update of every table the index is built from
+        row = conn.execute(text("""
+            SELECT (SELECT MAX(last_update) FROM film) AS film, (SELECT MAX(last_update) FROM actor) AS actor,
+            (SELECT MAX(last_update) FROM category) AS category, (SELECT MAX(last_update) FROM film_actor) AS film_actor,
+            (SELECT MAX(last_update) FROM film_category) AS film_category
+        """)).mappings().first()
+        return dict(row)
+
+    def build(self, conn): #loads everything from the db into fresh structures and swaps them in
+        watermarks = self.current_watermarks(conn) #read first so rows changed during the build are picked up by the next refresh
+        fresh = SearchIndex(self.refresh_interval, self.rebuild_interval)
+        for film_id, title in conn.execute(text("SELECT film_id, title FROM film")):
+            fresh.titles.put(film_id, title)
+        for actor_id, first_name, last_name in conn.execute(text("SELECT actor_id, first_name, last_name FROM actor")):
+            fresh.actors.put(actor_id, f"{first_name} {last_name}") #same string the CONCAT in the SQL search builds
+        for category_id, name in conn.execute(text("SELECT category_id, name FROM category")):
+            fresh.categories.put(category_id, name)
+        for actor_id, film_id in conn.execute(text("SELECT actor_id, film_id FROM film_actor")):
+            fresh.link(fresh.actor_films, fresh.film_actors, actor_id, film_id)
+        for film_id, category_id in conn.execute(text("SELECT film_id, category_id FROM film_category")):
+            fresh.link(fresh.category_films, fresh.film_categories, category_id, film_id)
+        with self.lock:
+            self.titles, self.actors, self.categories = fresh.titles, fresh.actors, fresh.categories
+            self.actor_films, self.film_actors = fresh.actor_films, fresh.film_actors
+            self.category_films, self.film_categories = fresh.category_films, fresh.film_categories
+            self.watermarks = watermarks
+            self.built_at = self.checked_at = time.monotonic()
+
+    def link(self, by_key, by_film, key, film_id): #records that a film belongs to an actor or category
+        by_key.setdefault(key, set()).add(film_id)
+        by_film.setdefault(film_id, set()).add(key)
+
+    def link_rows(self, conn, table, column, since): #the films whose links changed and every link row they have now, read without holding the lock
+        film_ids = conn.execute(text(f"SELECT DISTINCT film_id FROM {table} WHERE last_update >= :since"), {"since": since}).scalars().all()
+        if not film_ids:
+            return [], []
+        sql = text(f"SELECT {column}, film_id FROM {table} WHERE film_id IN :film_ids").bindparams(bindparam("film_ids", expanding = True))
+        return film_ids, conn.execute(sql, {"film_ids": film_ids}).all()
+
+    def relink(self, by_key, by_film, film_ids, rows): #replaces every link of the given films with the rows read for them, caller holds the lock
+        for film_id in film_ids:
+            for key in by_film.pop(film_id, set()):
+                by_key.get(key, set()).discard(film_id)
+        for key, film_id in rows:
+            self.link(by_key, by_film, key, film_id)
+
+    def refresh(self, conn): #applies only the rows whose last_update moved past the stored watermark
+        watermarks = self.current_watermarks(conn)
+        changed = {table for table, value in watermarks.items() if value is not None and value != self.watermarks.get(table)}
+        if not changed:
+            return
+        since = lambda table: self.watermarks.get(table) or "1970-01-01" #rows newer or equal to the old watermark, equal catches same second updates
+        #every query runs before taking the lock so searches only wait for the in-memory updates
+        films = conn.execute(text("SELECT film_id, title FROM film WHERE last_update >= :since"), {"since": since("film")}).all() if "film" in changed else []
+        actors = conn.execute(text("SELECT actor_id, first_name, last_name FROM actor WHERE last_update >= :since"), {"since": since("actor")}).all() if "actor" in changed else []
+        categories = conn.execute(text("SELECT category_id, name FROM category WHERE last_update >= :since"), {"since": since("category")}).all() if "category" in changed else []
+        actor_links = self.link_rows(conn, "film_actor", "actor_id", since("film_actor")) if "film_actor" in changed else ([], [])
+        category_links = self.link_rows(conn, "film_category", "category_id", since("film_category")) if "film_category" in changed else ([], [])
+        with self.lock:
+            for film_id, title in films:
+                self.titles.put(film_id, title)
+            for actor_id, first_name, last_name in actors:
+                self.actors.put(actor_id, f"{first_name} {last_name}")
+            for category_id, name in categories:
+                self.categories.put(category_id, name)
+            self.relink(self.actor_films, self.film_actors, *actor_links)
+            self.relink(self.category_films, self.film_categories, *category_links)
+            self.watermarks = watermarks
+
+    def ensure_fresh(self, conn): #builds on first use, then refreshes or rebuilds when their intervals are up, one thread at a time
+        if self.built_at is None: #nothing to search yet, so every thread waits for the one doing the first build
+            with self.updating:
+                if self.built_at is None:
+                    self.build(conn)
+            return
+        now = time.monotonic()
+        if now - self.built_at < self.rebuild_interval and now - self.checked_at < self.refresh_interval:
+            return
+        if not self.updating.acquire(blocking = False):
+            return #another thread is already updating, this search uses the current index
+        try:
+            now = time.monotonic()
+            if now - self.built_at >= self.rebuild_interval:
+                self.build(conn)
+            elif now - self.checked_at >= self.refresh_interval:
+                self.checked_at = now
+                self.refresh(conn)
+        finally:
+            self.updating.release()
+
+    def search(self, conn, title = "", actor = "", genre = ""): #returns the matching film_ids sorted like the SQL search, or None if the SQL search has to answer
+        if any(w in value for value in (title, actor, genre) for w in WILDCARDS):
+            return None #LIKE wildcards typed by the user, let the db apply its own rules
+        self.ensure_fresh(conn)
+        with self.lock:
+            matches = [] #one set of film_ids per filter, intersected at the end
+            if title:
+                matches.append(self.titles.match(title))
+            if actor:
+                matches.append({film_id for actor_id in self.actors.match(actor) for film_id in self.actor_films.get(actor_id, ())})
+            if genre:
+                matches.append({film_id for category_id in self.categories.match(genre) for film_id in self.category_films.get(category_id, ())})
+            if not matches:
+                return sorted(self.titles.texts) #no filters means every film
+            matches.sort(key = len) #intersecting from the smallest set keeps the work small
+            result = matches[0]
+            for other in matches[1:]:
+                result = result & other
+            if actor or genre:
+                result = {film_id for film_id in result if film_id in self.titles.texts} #link rows can outlive a deleted film until the next rebuild
+        return sorted(result) #same order as ORDER BY f.film_id
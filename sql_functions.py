@@ -0,0 +1,57 @@
+from sqlalchemy.ext.compiler import compiles #renders our functions differently per database
+from sqlalchemy.sql.functions import FunctionElement #base for SQL functions
+from sqlalchemy.sql.expression import literal_column #for separators, MySQL wants them inline
+from sqlalchemy.types import String, DateTime, Integer #result types, so SQLite dates come back as datetimes too
+
+#functions MySQL and SQLite spell differently, written once here so the queries run on both
+#the default rendering is the MySQL one, SQLite gets its own below
+
+class group_concat(FunctionElement): #sorted distinct values joined by a separator, group_concat(c.name) gives "Action, Comedy"
+    type = String()
+    name = "group_concat"
+    inherit_cache = True
+
+    def __init__(self, expression, separator = ", "):
+        super().__init__(expression, literal_column("'" + separator.replace("'", "''") + "'"))
+
+@compiles(group_concat)
+def group_concat_mysql(element, compiler, **kw):
+    expression, separator = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f"GROUP_CONCAT(DISTINCT {expression} ORDER BY {expression} SEPARATOR {separator})"
+
+@compiles(group_concat, "sqlite")
+def group_concat_sqlite(element, compiler, **kw): #SQLite only allows DISTINCT with the default separator, our joins never repeat a value anyway
+    expression, separator = [compiler.process(clause, **kw) for clause in element.clauses]
+    if compiler.dialect.dbapi is not None and compiler.dialect.dbapi.sqlite_version_info >= (3, 44):
+        return f"group_concat({expression}, {separator} ORDER BY {expression})" #ORDER BY inside aggregates arrived in 3.44
+    return f"group_concat({expression}, {separator})"
+
+class add_days(FunctionElement): #add_days(r.rental_date, f.rental_duration), a date plus a number of days
+    type = DateTime()
+    name = "add_days"
+    inherit_cache = True
+
+@compiles(add_days)
+def add_days_mysql(element, compiler, **kw):
+    date, days = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f"DATE_ADD({date}, INTERVAL {days} DAY)"
+
+@compiles(add_days, "sqlite")
+def add_days_sqlite(element, compiler, **kw):
+    date, days = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f"datetime({date}, '+' || {days} || ' days')"
+
+class days_between(FunctionElement): #whole days from the first date to the second, rounded toward zero
+    type = Integer()
+    name = "days_between"
+    inherit_cache = True
+
+@compiles(days_between)
+def days_between_mysql(element, compiler, **kw):
+    start, end = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f"TIMESTAMPDIFF(DAY, {start}, {end})"
+
+@compiles(days_between, "sqlite")
+def days_between_sqlite(element, compiler, **kw):
+    start, end = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f"CAST(julianday({end}) - julianday({start}) AS INTEGER)"
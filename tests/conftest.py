@@ -0,0 +1,93 @@
+#every test runs against a small in-memory SQLite Sakila, built from the same table definitions benchmarks/generate_data.py uses
+#main.py connects to DATABASE_URL when it is imported, so the environment is set before the import below
+import os, sys #for the import paths and environment
+from datetime import datetime, timedelta #for rental dates
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT) #main.py and the other modules
+sys.path.insert(0, os.path.join(ROOT, "benchmarks")) #generate_data.py for the schema
+
+os.environ["DATABASE_URL"] = "sqlite://" #in-memory, flask-sqlalchemy shares one connection so every thread sees the same data
+for flag in ("SEARCH_INDEX", "LEADERBOARD", "RENTAL_STATS", "INVENTORY_ALLOCATOR", "RESPONSE_CACHE", "QUERY_FANOUT", "ADMISSION_CONTROL", "COMPRESSION"):
+    os.environ[flag] = "0" #tests turn flags on through app.config
+os.environ["SLOW_QUERY_MS"] = "60000" #nothing in the fixture is slow, keeps the log quiet
+
+import main #the flask app and everything it sets up
+import generate_data #table definitions
+import rental_stats #for rebuilding the rollup after the data is reset
+
+FLAGS = ("SEARCH_INDEX", "LEADERBOARD", "RENTAL_STATS", "INVENTORY_ALLOCATOR", "RESPONSE_CACHE", "QUERY_FANOUT") #flags that must not change what a route returns
+
+SAME_SECOND = datetime(2005, 7, 1, 12, 0, 0) #customer 1 has three returned rentals at exactly this time, for history paging
+
+def fixture_rows(): #table -> rows, small enough to reason about in the tests
+    t = generate_data
+    rows = {
+        t.country: [{"country_id": 1, "country": "Canada"}],
+        t.city: [{"city_id": 1, "city": "Lethbridge", "country_id": 1}],
+        t.address: [{"address_id": i, "address": f"{i} MySakila Drive", "address2": None, "district": "Alberta", "city_id": 1, "postal_code": "10000", "phone": "5555555"} for i in range(1, 7)],
+        t.language: [{"language_id": 1, "name": "English"}],
+        t.category: [{"category_id": i, "name": name} for i, name in enumerate(["Action", "Comedy", "Drama"], 1)],
+        t.film: [{
+            "film_id": i, "title": title, "description": f"A story about {title.title()}", "release_year": 2006, "language_id": 1, "rental_duration": 3 + i % 4,
+            "rental_rate": "4.99" if i % 2 else "0.99", "length": 80 + i, "replacement_cost": "19.99", "rating": "PG", "special_features": "Trailers,Commentaries",
+        } for i, title in enumerate(["ALPHA ACADEMY", "BETA BOULEVARD", "GAMMA GARDEN", "DELTA DAWN", "EPSILON EGG", "ZETA ZOO"], 1)],
+        t.actor: [{"actor_id": i, "first_name": first, "last_name": last} for i, (first, last) in enumerate([("PENELOPE", "GUINESS"), ("NICK", "WAHLBERG"), ("ED", "CHASE"), ("JENNIFER", "DAVIS")], 1)],
+        t.film_actor: [{"actor_id": actor_id, "film_id": film_id} for actor_id, films in {1: [1, 2, 3, 4], 2: [1, 2, 3], 3: [1, 5], 4: [6]}.items() for film_id in films],
+        t.film_category: [{"film_id": film_id, "category_id": category_id} for film_id, category_id in [(1, 1), (2, 2), (3, 1), (4, 3), (5, 2), (6, 3)]],
+        t.customer: [{
+            "customer_id": i, "store_id": 1, "first_name": first, "last_name": last, "email": f"{first}.{last}@sakilacustomer.org".lower(),
+            "address_id": i, "active": 0 if i == 5 else 1, "create_date": datetime(2006, 2, 14, 22, 4, 36),
+        } for i, (first, last) in enumerate([("MARY", "SMITH"), ("PATRICIA", "JOHNSON"), ("LINDA", "WILLIAMS"), ("BARBARA", "JONES"), ("ELIZABETH", "BROWN")], 1)],
+        #film 1 has copies 1-3 in store 1 and copy 9 in store 2, film 3 has one copy and it is rented out, film 6 has no copies
+        t.inventory: [{"inventory_id": inventory_id, "film_id": film_id, "store_id": 2 if inventory_id == 9 else 1} for inventory_id, film_id in [(1, 1), (2, 1), (3, 1), (4, 2), (5, 2), (6, 3), (7, 4), (8, 5), (9, 1)]],
+    }
+    rentals = [] #(inventory_id, customer_id, rental_date, returned), films 1 to 5 end up with 8, 6, 5, 4 and 2 rentals so the top 5 has no ties
+    start = datetime(2005, 5, 25, 10, 0, 0)
+    plan = [(1, 6, False), (4, 5, False), (6, 5, True), (7, 3, False), (8, 2, False)] #(first copy of the film, rentals, newest one still out)
+    for film_index, (inventory_id, count, still_out) in enumerate(plan):
+        for n in range(count):
+            rentals.append((inventory_id, 1 + (film_index + n) % 4, start + timedelta(days = film_index * 10 + n), not (still_out and n == count - 1)))
+    rentals.append((2, 3, datetime(2005, 8, 1, 9, 0, 0), False)) #one copy of film 1 is out
+    rentals += [(copy, 1, SAME_SECOND, True) for copy in (3, 5, 7)] #same second rentals for customer 1
+    rows[t.rental] = [{
+        "rental_id": rental_id, "rental_date": rental_date, "inventory_id": inventory_id, "customer_id": customer_id,
+        "return_date": rental_date + timedelta(days = 2) if returned else None, "staff_id": 1,
+    } for rental_id, (inventory_id, customer_id, rental_date, returned) in enumerate(rentals, 1)]
+    return rows
+
+def load(engine): #empties every table and loads the fixture rows
+    with engine.begin() as conn:
+        for table in reversed(generate_data.metadata.sorted_tables):
+            conn.execute(table.delete())
+        for table, rows in fixture_rows().items():
+            conn.execute(table.insert(), rows)
+        rental_stats.rebuild(conn)
+
+def reset_state(): #forgets everything the in-memory features built from earlier data
+    main.response_cache.clear()
+    main.count_cache.clear()
+    main.search_index.built_at = None
+    main.leaderboard.built_at = None
+    main.leaderboard.loaded = False
+    main.allocator.pools.clear()
+    main.allocator.loaded_at.clear()
+    main.allocator.claimed.clear()
+
+@pytest.fixture(scope = "session")
+def app():
+    with main.app.app_context():
+        generate_data.metadata.create_all(main.db.engine)
+    return main.app
+
+@pytest.fixture
+def client(app): #fresh data and every flag off, tests turn on what they need
+    with app.app_context():
+        load(main.db.engine)
+    reset_state()
+    saved = dict(app.config)
+    for flag in FLAGS + ("ADMISSION_CONTROL", "COMPRESSION"):
+        app.config[flag] = False
+    yield app.test_client()
+    app.config.update(saved)
@@ -0,0 +1,103 @@
+#POST /api/rentals and /api/rentals/batch, with every feature that has to see a new rental turned on and off
+import itertools #for flag combinations
+import pytest
+from sqlalchemy import text #for a lock query that fails
+import main #for the shared queries
+
+WRITE_FLAGS = ("RENTAL_STATS", "INVENTORY_ALLOCATOR", "LEADERBOARD", "RESPONSE_CACHE")
+
+def flag_sets():
+    return [pytest.param(dict(zip(WRITE_FLAGS, values)), id = "-".join(flag for flag, on in zip(WRITE_FLAGS, values) if on) or "none") for values in itertools.product((False, True), repeat = len(WRITE_FLAGS))]
+
+def customer_row(client, customer_id): #the customer as the listing shows it
+    return client.get(f"/api/customers/search?customer_id={customer_id}").get_json()["items"][0]
+
+def warm(client): #reads that fill the cache, leaderboard and allocator before the write
+    client.get("/api/films/top5")
+    client.get("/api/films/1")
+    client.get("/api/films?ids=1,3")
+    client.get("/api/customers/4")
+    customer_row(client, 4)
+
+@pytest.mark.parametrize("flags", flag_sets())
+def test_rent_film(client, app, flags):
+    app.config.update(flags)
+    warm(client)
+    before = customer_row(client, 4)["total_rentals"]
+    response = client.post("/api/rentals", json = {"customer_id": 4, "film_id": 1})
+    assert response.status_code == 200 and response.get_json()["ok"]
+    film = client.get("/api/films/1").get_json()
+    assert (film["available_copies"], film["rentals_count"]) == (1, 9)
+    assert client.get("/api/films?ids=1").get_json()[0]["available_copies"] == 1
+    assert client.get("/api/films/top5").get_json()[0]["rentals_count"] == 9
+    assert [r["film_id"] for r in client.get("/api/customers/4").get_json()["current_rentals"]] == [1]
+    row = customer_row(client, 4)
+    assert (row["total_rentals"], row["current_rentals"]) == (before + 1, 1)
+    assert client.post("/api/rentals", json = {"customer_id": 4, "film_id": 1}).status_code == 200
+    last = client.post("/api/rentals", json = {"customer_id": 4, "film_id": 1})
+    assert last.status_code == 400 and last.get_json()["error"] == "No available copies for this film"
+
+@pytest.mark.parametrize("allocator", [False, True])
+@pytest.mark.parametrize("payload, status", [
+    ({}, 400),
+    ({"customer_id": 1}, 400),
+    ({"customer_id": 1, "film_id": "abc"}, 400),
+    ({"customer_id": "x", "film_id": 1}, 400),
+    ({"customer_id": 99, "film_id": 1}, 404),
+    ({"customer_id": 5, "film_id": 1}, 400), #inactive
+    ({"customer_id": 1, "film_id": 3}, 400), #only copy is out
+    ({"customer_id": 1, "film_id": 6}, 400), #no copies at all
+])
+def test_rent_film_rejections(client, app, allocator, payload, status):
+    app.config["INVENTORY_ALLOCATOR"] = allocator
+    response = client.post("/api/rentals", json = payload)
+    assert response.status_code == status and not response.get_json()["ok"]
+    assert client.get("/api/films/1").get_json()["available_copies"] == 2 #nothing was rented
+
+def test_failed_lock_gives_the_copy_back(client, app, monkeypatch):
+    app.config["INVENTORY_ALLOCATOR"] = True
+    assert client.get("/api/films/1").get_json()["available_copies"] == 2
+    get = main.queries.get
+    monkeypatch.setattr(main.queries, "get", lambda name, *options: text("SELECT no_such_column FROM inventory") if name == "lock_copy" else get(name, *options)) #fails like a lock wait timeout would
+    assert client.post("/api/rentals", json = {"customer_id": 4, "film_id": 1}).status_code == 500
+    monkeypatch.undo()
+    assert client.get("/api/films/1").get_json()["available_copies"] == 2
+    for _ in range(2):
+        assert client.post("/api/rentals", json = {"customer_id": 4, "film_id": 1}).status_code == 200
+
+@pytest.mark.parametrize("flags", flag_sets())
+def test_rent_films_batch(client, app, flags):
+    app.config.update(flags)
+    warm(client)
+    items = [
+        {"customer_id": 2, "film_id": 1},
+        {"customer_id": 2, "film_id": 1},
+        {"customer_id": 2, "film_id": 1}, #film 1 only had two free copies
+        {"customer_id": 5, "film_id": 2}, #inactive
+        {"customer_id": 2, "film_id": "x"},
+        {"customer_id": 2},
+        {"customer_id": 3, "film_id": 2},
+    ]
+    data = client.post("/api/rentals/batch", json = {"items": items}).get_json()
+    assert [r["status"] for r in data["results"]] == [200, 200, 400, 400, 400, 400, 200]
+    assert not data["ok"]
+    assert client.get("/api/films/1").get_json()["available_copies"] == 0
+    assert client.get("/api/films/2").get_json()["available_copies"] == 1
+    assert client.get("/api/films/top5").get_json()[0]["rentals_count"] == 10
+    assert customer_row(client, 2)["current_rentals"] == 2
+
+def test_rental_stats_follow_every_write(client, app):
+    client.post("/api/rentals", json = {"customer_id": 4, "film_id": 1}) #rented while RENTAL_STATS is off
+    client.post("/api/rentals/batch", json = {"items": [{"customer_id": 2, "film_id": 2}, {"customer_id": 4, "film_id": 4}]})
+    with app.app_context(), main.db.engine.begin() as conn: #writes from outside the app
+        conn.execute(text("UPDATE rental SET return_date = rental_date WHERE customer_id = 3 AND return_date IS NULL")) #a return
+        conn.execute(text("DELETE FROM rental WHERE rental_id = (SELECT rental_id FROM rental WHERE customer_id = 4 ORDER BY rental_date DESC LIMIT 1)")) #customer 4's latest date has to be looked up again
+        conn.execute(text("UPDATE rental SET customer_id = 2 WHERE rental_id = 1")) #moved to another customer
+    scanned = client.get("/api/customers?pageSize=10").get_json()["items"]
+    app.config["RENTAL_STATS"] = True
+    assert client.get("/api/customers?pageSize=10").get_json()["items"] == scanned
+
+def test_rent_films_batch_rejects_bad_bodies(client):
+    assert client.post("/api/rentals/batch", json = {}).status_code == 400
+    assert client.post("/api/rentals/batch", json = {"items": []}).status_code == 400
+    assert client.post("/api/rentals/batch", json = {"items": [{"customer_id": 1, "film_id": 1}] * 101}).status_code == 400
@@ -0,0 +1,148 @@
+#every GET route, checked against the fixture and against itself with each combination of the optional features turned on
+import gzip, itertools #for the compression test and flag combinations
+from datetime import datetime #for comparing the two date formats
+from email.utils import parsedate_to_datetime #jsonify writes dates as HTTP dates
+import pytest
+from conftest import FLAGS, SAME_SECOND
+import main #for admission classes
+from admission import CostClass #for forcing a rejection
+
+GETS = [ #one request per route and search shape
+    "/api/films/top5", "/api/actors/top5", "/api/films/1", "/api/films/3", "/api/actors/1",
+    "/api/films?ids=3,1,2,999", "/api/actors?ids=2,1",
+    "/api/films/search", "/api/films/search?title=al", "/api/films/search?actor=guin", "/api/films/search?genre=act", "/api/films/search?actor=nick&genre=com",
+    "/api/films/search?title=a&pageSize=2&page=2", "/api/films/search?title=a&pageSize=2&cursor=", "/api/films/search?title=a&cursor=&includeTotal=1",
+    "/api/customers?page=1&pageSize=2", "/api/customers/search?last_name=jo", "/api/customers/search?customer_id=2", "/api/customers/search?first_name=a&cursor=&pageSize=2",
+    "/api/customers/1", "/api/customers/1?historyPageSize=2",
+    "/api/export/customers", "/api/export/customers?format=csv", "/api/export/customers/1/rentals", "/api/export/rentals?format=csv",
+]
+LISTS = [ #routes that also answer with ?format=columnar
+    "/api/films/search?title=a", "/api/films/search?genre=act&cursor=", "/api/customers?pageSize=3", "/api/customers/search?last_name=j", "/api/customers/1",
+]
+
+def body(response, path): #what a route returned, the parts that may differ between flags taken out
+    if not response.is_json: #csv and ndjson exports
+        return response.get_data(as_text = True)
+    data = response.get_json()
+    if "cursor=" in path and "includeTotal" not in path:
+        data.pop("total", None) #the search index knows the total for free, SQL only counts it when asked
+    return data
+
+def fetch_all(client, paths):
+    results = {}
+    for path in paths:
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.data[:300])
+        results[path] = body(response, path)
+    return results
+
+def flag_sets(): #every combination of the feature flags, as ids pytest can show
+    return [pytest.param(dict(zip(FLAGS, values)), id = "-".join(flag for flag, on in zip(FLAGS, values) if on) or "none") for values in itertools.product((False, True), repeat = len(FLAGS))]
+
+def test_fixture_answers(client):
+    assert [r["film_id"] for r in client.get("/api/films/top5").get_json()] == [1, 2, 3, 4, 5]
+    assert [r["actor_id"] for r in client.get("/api/actors/top5").get_json()] == [1, 2, 3, 4]
+    film = client.get("/api/films/1").get_json()
+    assert (film["total_copies"], film["available_copies"], film["rentals_count"]) == (3, 2, 8) #copy 9 is in the other store
+    assert client.get("/api/films/3").get_json()["available_copies"] == 0
+    assert [r["id"] for r in client.get("/api/films?ids=3,1,999").get_json()] == [3, 1]
+    assert [r["film_id"] for r in client.get("/api/films/search?actor=guin").get_json()["items"]] == [1, 2, 3, 4]
+    assert [r["film_id"] for r in client.get("/api/films/search?actor=nick&genre=com").get_json()["items"]] == [2]
+    assert [r["customer_id"] for r in client.get("/api/customers/search?last_name=jo").get_json()["items"]] == [2, 4]
+    assert client.get("/api/customers/3").get_json()["current_rentals"][0]["film_id"] == 1
+
+@pytest.mark.parametrize("path", GETS)
+def test_get_routes(client, path):
+    assert client.get(path).status_code == 200
+
+def test_bad_requests(client):
+    assert client.get("/api/films?ids=1,x").status_code == 400
+    assert client.get("/api/films/search?title=a&cursor=nonsense").status_code == 400
+    assert client.get("/api/customers/1?historyCursor=nonsense").status_code == 400
+    assert client.get("/api/export/rentals?format=xml").status_code == 400
+
+@pytest.mark.parametrize("flags", flag_sets())
+def test_flags_do_not_change_responses(client, app, flags):
+    paths = GETS + [path + ("&" if "?" in path else "?") + "format=columnar" for path in LISTS]
+    expected = fetch_all(client, paths)
+    app.config.update(flags)
+    for _ in range(2): #the second round is served from the response cache when it is on
+        assert fetch_all(client, paths) == expected
+
+def same_value(row_value, columnar_value): #jsonify writes HTTP dates, the columnar encoder ISO 8601
+    if isinstance(row_value, str) and isinstance(columnar_value, str) and row_value.endswith(" GMT"):
+        return parsedate_to_datetime(row_value).replace(tzinfo = None) == datetime.fromisoformat(columnar_value)
+    return row_value == columnar_value
+
+@pytest.mark.parametrize("path", LISTS)
+def test_columnar_matches_rows(client, path):
+    rows = client.get(path).get_json()
+    columnar = client.get(path + ("&" if "?" in path else "?") + "format=columnar").get_json()
+    for key, value in rows.items():
+        if isinstance(value, list) and key != "actors":
+            table = columnar[key]
+            assert len(table["rows"]) == len(value)
+            for row, values in zip(value, table["rows"]):
+                assert set(row) == set(table["columns"])
+                assert all(same_value(row[name], v) for name, v in zip(table["columns"], values)), (row, values)
+        else:
+            assert same_value(value, columnar[key]), key
+
+def test_columnar_empty_page_keeps_columns(client):
+    items = client.get("/api/customers/search?last_name=zzz&format=columnar").get_json()["items"]
+    assert items["rows"] == [] and "customer_id" in items["columns"]
+
+def test_history_paging_keeps_same_second_rentals(client):
+    full = [r["rental_id"] for r in client.get("/api/customers/1").get_json()["rental_history"]]
+    paged, cursor = [], ""
+    while True:
+        data = client.get("/api/customers/1?historyPageSize=1" + (f"&historyCursor={cursor}" if cursor else "")).get_json()
+        paged += [r["rental_id"] for r in data["rental_history"]]
+        cursor = data["historyNextCursor"]
+        if not cursor:
+            break
+    assert paged == full
+    same = [r for r in client.get("/api/customers/1").get_json()["rental_history"] if parsedate_to_datetime(r["rental_date"]).replace(tzinfo = None) == SAME_SECOND]
+    assert len(same) == 3
+
+@pytest.mark.parametrize("search", ["/api/films/search?title=a", "/api/customers/search?first_name=a"])
+def test_cursor_paging_matches_pages(client, search):
+    key = "film_id" if "films" in search else "customer_id"
+    expected = [r[key] for r in client.get(search + "&pageSize=50").get_json()["items"]]
+    seen, cursor = [], ""
+    while cursor is not None:
+        data = client.get(f"{search}&pageSize=2&cursor={cursor}").get_json()
+        seen += [r[key] for r in data["items"]]
+        cursor = data["nextCursor"]
+    assert seen == expected
+
+def test_operations_routes(client, app):
+    assert client.get("/api/metrics").status_code == 200
+    assert client.get("/api/metrics/slow").status_code == 404
+    assert client.get("/api/cache").status_code == 200
+    assert client.get("/api/admission").status_code == 200
+
+def test_compression(client, app):
+    app.config["COMPRESSION"] = True
+    plain = client.get("/api/customers/1").get_data()
+    response = client.get("/api/customers/1", headers = {"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip" and "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.get_data()) == plain
+    small = client.get("/api/films/search?actor=nick&genre=com", headers = {"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers #under the size threshold
+
+def test_compressed_revalidation(client, app):
+    app.config.update(COMPRESSION = True, RESPONSE_CACHE = True)
+    first = client.get("/api/customers/1", headers = {"Accept-Encoding": "gzip"})
+    assert first.headers["ETag"].startswith("W/")
+    again = client.get("/api/customers/1", headers = {"Accept-Encoding": "gzip", "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.headers["ETag"] == first.headers["ETag"] and "Accept-Encoding" in again.headers["Vary"]
+
+def test_admission_control(client, app, monkeypatch):
+    app.config["ADMISSION_CONTROL"] = True
+    for path in GETS:
+        assert client.get(path).status_code == 200, path
+    monkeypatch.setitem(main.admission.classes, "heavy", CostClass(1, 0, 0, 0)) #one slot and no queue
+    monkeypatch.setitem(main.admission.active, "heavy", 1) #and the slot is taken
+    response = client.get("/api/customers")
+    assert response.status_code == 429 and int(response.headers["Retry-After"]) >= 1